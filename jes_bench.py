@@ -0,0 +1,185 @@
+import os
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # the rendering benchmarks draw to offscreen surfaces
+import argparse
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+from jes_headless import createSim, seedEverything
+
+# Seeded, headless benchmarks of the physics, generation turnover and rendering,
+# written to a JSON file so runs on different commits can be compared:
+#
+#   python jes_bench.py --out before.json
+#   (change things)
+#   python jes_bench.py --out after.json --compare before.json
+#
+# Every benchmark is timed `repeat` times, and both the best and the mean time are kept.
+# The rendering benchmarks need a UI. Where its fonts can't be loaded (on most machines
+# but the author's), pygame's default font stands in, and the report says so.
+
+def timeIt(run, repeat, setup=None):
+    times = []
+    for r in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter()-start)
+    return times
+
+NODE_UNITS = {"creature_frames": "node_frames", "creatures": "nodes"}
+
+def getResult(name, sim, times, units=None, unitName=None):
+    result = {"benchmark": name, "c_count": sim.c_count, "c_dim": [sim.CW,sim.CH],
+    "best_s": min(times), "mean_s": float(np.mean(times)), "runs": len(times)}
+    if units is not None: # a throughput, e.g. creatures simulated per second
+        result[unitName+"_per_s"] = units/min(times)
+        if unitName in NODE_UNITS: # and per node, so different body sizes can be compared
+            result[NODE_UNITS[unitName]+"_per_s"] = units*(sim.CW+1)*(sim.CH+1)/min(times)
+    return result
+
+def benchPhysics(sim, repeat):
+    C = sim.c_count
+    results = []
+    times = timeIt(lambda param: sim.simulateRun(param, sim.trial_time, False), repeat, lambda: sim.simulateImport(0, 0, C, True))
+    results.append(getResult("simulateRun_trial", sim, times, C*sim.trial_time, "creature_frames"))
+    times = timeIt(lambda param: sim.simulateRun(param, sim.stabilization_time, True), repeat, lambda: sim.simulateImport(0, 0, C, False))
+    results.append(getResult("simulateRun_calming", sim, times, C*sim.stabilization_time, "creature_frames"))
+
+    # the muscle step the way simulateRun does it: rest lengths loaded once, into a reused Workspace
+    nodeCoor, muscles, _ = sim.simulateImport(0, 0, C, True)
+    ws = sim.getWorkspace(nodeCoor)
+    ws.loadMuscles(muscles)
+    CALLS = 100
+    def applyMany():
+        for i in range(CALLS):
+            ws.applyMuscles(nodeCoor, i%sim.beats_per_cycle, sim.muscle_coef)
+    times = [t/CALLS for t in timeIt(applyMany, repeat)]
+    results.append(getResult("applyMuscles", sim, times, C, "creatures"))
+
+    times = timeIt(lambda _: sim.getCalmStates(0, 0, C, sim.stabilization_time, True), repeat, lambda: sim.calm_cache.clear()) # every creature calmed, none reused
+    results.append(getResult("getCalmStates", sim, times, C, "creatures"))
+    times = timeIt(lambda: sim.doGeneration(None), repeat)
+    results.append(getResult("doGeneration", sim, times, C, "creatures"))
+    return results
+
+def createUI(fallbacks):
+    # The same layout as jes.py. Every font that had to fall back to pygame's default is added to fallbacks.
+    import pygame
+    from jes_ui import UI
+    Font = pygame.font.Font
+    def loadFont(path, size):
+        try:
+            return Font(path, size)
+        except (OSError, FileNotFoundError): # pygame's font errors are OSErrors too
+            fallbacks.add(path)
+            return Font(None, size)
+    pygame.font.Font = loadFont
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(__file__))) # the UI loads visuals/ relative to the working directory
+    try:
+        return UI(_W_W=1920, _W_H=1078, _MOVIE_SINGLE_DIM=(650,650),
+        _GRAPH_COOR=(850,50,900,500), _SAC_COOR=(850,560,900,300), _GENEALOGY_COOR=(20,105,530,802,42),
+        _COLUMN_MARGIN=330, _MOSAIC_DIM=[10,24,24,30],
+        _MENU_TEXT_UP=180, _CM_MARGIN1=20, _CM_MARGIN2=1)
+    finally:
+        pygame.font.Font = Font
+        os.chdir(cwd)
+
+def benchRendering(sim, ui, repeat):
+    from jes_dataviz import drawAllGraphs
+    sim.ui = ui
+    ui.sim = sim
+    ui.addButtonsAndSliders()
+    gen = len(sim.creatures)-1
+    generation = sim.creatures[gen]
+    C = sim.c_count
+    results = []
+    def drawIcons():
+        for c in range(C):
+            generation[c].drawIcon(ui.ICON_DIM[0], ui.MOSAIC_COLOR, sim.beat_fade_time)
+    times = timeIt(drawIcons, repeat)
+    results.append(getResult("drawIcon", sim, times, C, "icons"))
+    times = timeIt(lambda: drawAllGraphs(sim, ui), repeat)
+    results.append(getResult("drawAllGraphs", sim, times))
+    def drawMosaic(): # from scratch, icons included
+        ui.iconCache.clear()
+        ui.drawCreatureMosaic(gen)
+    times = timeIt(drawMosaic, repeat)
+    results.append(getResult("drawCreatureMosaic", sim, times))
+    sim.ui = None
+    ui.sim = None
+    return results
+
+def getGitCommit():
+    try:
+        return subprocess.run(["git","rev-parse","HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def runBenchmarks(c_counts, c_dims, repeat=3, seed=0, float_type=np.float64, rendering=True, verbose=True):
+    skipped = None
+    fallbacks = set() # fonts the UI couldn't load
+    results = []
+    for c_dim in c_dims:
+        for c_count in c_counts:
+            seedEverything(seed)
+            sim = createSim(c_count, float_type, c_dim=c_dim)
+            sim.initializeUniverse()
+            newResults = benchPhysics(sim, repeat)
+            if rendering and skipped is None:
+                try:
+                    ui = createUI(fallbacks) # a fresh one per Sim, so no icons or graphs carry over
+                except (OSError, ImportError) as e: # e.g. no pygame, or not even its default font
+                    skipped = f"rendering benchmarks skipped: {e}"
+                    if verbose:
+                        print(skipped)
+                else:
+                    if fallbacks and verbose and len(results) == 0:
+                        print(f"fonts not found, using pygame's default instead: {', '.join(sorted(fallbacks))}")
+                    newResults += benchRendering(sim, ui, repeat)
+            for result in newResults:
+                if verbose:
+                    nodes = "".join(f"  {result[unit+'_per_s']:12.0f} {unit}/s" for unit in NODE_UNITS.values() if unit+"_per_s" in result)
+                    print(f"{result['benchmark']:>20} {c_count:>5} creatures {c_dim[0]}x{c_dim[1]}: {result['best_s']*1000:10.2f} ms{nodes}")
+            results += newResults
+    meta = {"commit": getGitCommit(), "time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+    "numpy": np.__version__, "machine": platform.platform(), "seed": seed, "repeat": repeat,
+    "float_type": np.dtype(float_type).name, "skipped": skipped, "font_fallbacks": sorted(fallbacks)}
+    return {"meta": meta, "results": results}
+
+def compareResults(old, new):
+    # old/new time of every benchmark both runs have, by best time
+    oldTimes = {(r["benchmark"], r["c_count"], tuple(r["c_dim"])): r["best_s"] for r in old["results"]}
+    for r in new["results"]:
+        key = (r["benchmark"], r["c_count"], tuple(r["c_dim"]))
+        if key in oldTimes:
+            print(f"{r['benchmark']:>20} {r['c_count']:>5} creatures {key[2][0]}x{key[2][1]}: {oldTimes[key]/r['best_s']:6.2f}x speedup ({oldTimes[key]*1000:.2f} -> {r['best_s']*1000:.2f} ms)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Jelly Evolution Simulator.")
+    parser.add_argument("--out", default="jes_bench.json", help="JSON file the results are written to")
+    parser.add_argument("--creatures", default="100,250,500,5000", help="comma-separated population sizes")
+    parser.add_argument("--dims", default="4x4,8x8,16x16,32x8", help="comma-separated creature sizes, in cells (width x height)")
+    parser.add_argument("--repeat", type=int, default=3, help="how many times each benchmark is timed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--float32", action="store_true", help="simulate in float32 instead of float64")
+    parser.add_argument("--no-rendering", action="store_true", help="skip the rendering benchmarks")
+    parser.add_argument("--compare", default=None, help="an earlier results file to compare against")
+    args = parser.parse_args()
+
+    c_counts = [int(c) for c in args.creatures.split(",")]
+    if any(c < 2 or c%2 != 0 for c in c_counts):
+        parser.error("--creatures must all be even and at least 2 (creatures are paired off to reproduce)")
+    c_dims = [tuple(int(d) for d in dim.split("x")) for dim in args.dims.split(",")]
+    report = runBenchmarks(c_counts, c_dims, args.repeat, args.seed, np.float32 if args.float32 else np.float64, not args.no_rendering)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compareResults(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
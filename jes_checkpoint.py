@@ -0,0 +1,137 @@
+import os
+import json
+import random
+import numpy as np
+from jes_generation import Generation
+from jes_species_info import SpeciesInfo
+from jes_species_pops import SpeciesPops
+from jes_history import History
+from jes_growable import GrowableArray
+
+# On-disk layout of a checkpoint directory:
+#   dna.bin, species.bin, ... : every finished generation's columns, appended as raw rows
+#                               (the same files jes_history.py spills to and reads back from)
+#   rankings.bin, percentiles.bin, species_pops.jsonl : one more row/line per finished generation
+#   newest.npz   : the newest generation, which is calmed but not tested yet
+#   species.npz  : every species' genealogy info
+#   meta.json    : settings, counts and RNG states. It's written last, so whatever it
+#                  says has been saved is complete, even if the process died mid-save.
+
+class Checkpoint:
+    # Saves a Sim a little after every generation (see Sim.doGeneration), and resumes one.
+    # Only what's new gets appended, so saving stays cheap however long the run gets,
+    # and loading maps the old generations in from disk instead of reading them.
+    def __init__(self, sim, directory):
+        self.sim = sim
+        self.directory = directory
+        self.saved = 0 # finished generations whose rows are already appended
+
+    def exists(self):
+        return os.path.exists(self.getPath("meta.json"))
+
+    def save(self):
+        sim = self.sim
+        os.makedirs(self.directory, exist_ok=True)
+        G = len(sim.rankings) # finished generations
+        if G == 0: # a brand new run: whatever an older run left here is stale
+            for name in [column+".bin" for column in History.COLUMNS]+["rankings.bin","percentiles.bin","species_pops.jsonl","meta.json"]:
+                if os.path.exists(self.getPath(name)):
+                    os.remove(self.getPath(name))
+        sim.creatures.flush(G)
+        with open(self.getPath("rankings.bin"), "ab") as f:
+            f.write(np.ascontiguousarray(sim.rankings[self.saved:G], dtype=np.int64).tobytes())
+        with open(self.getPath("percentiles.bin"), "ab") as f:
+            f.write(np.ascontiguousarray(sim.percentiles[self.saved:G], dtype=np.float64).tobytes())
+        with open(self.getPath("species_pops.jsonl"), "a") as f:
+            for g in range(self.saved, G):
+                f.write(json.dumps([sim.species_pops[g].species, sim.species_pops[g].pops])+"\n")
+        self.saved = G
+
+        newest = sim.creatures[G]
+        self.replace("newest.npz", lambda f: np.savez(f, dna=newest.dna, species=newest.species,
+        calmStates=newest.calmStates, codonWithChange=newest.codonWithChange))
+        info = sim.species_info
+        self.replace("species.npz", lambda f: np.savez(f,
+        ancestorID=np.array([-1 if i.ancestorID is None else i.ancestorID for i in info], dtype=int),
+        level=np.array([i.level for i in info], dtype=int),
+        apex_pop=np.array([i.apex_pop for i in info], dtype=int),
+        reps=np.array([i.reps for i in info], dtype=int).reshape((len(info),4)),
+        prominent=np.array([i.prominent for i in info], dtype=bool)))
+
+        npState = np.random.get_state()
+        meta = {"generations": G, "c_count": sim.c_count, "c_dim": [sim.CW,sim.CH],
+        "trait_count": sim.trait_count, "float_type": sim.float_type.name,
+        "species_count": sim.species_count, "prominent_species": sim.prominent_species,
+        "last_gen_run_time": sim.last_gen_run_time,
+        "percentile_resolution": sim.HUNDRED,
+        "rng_state": sim.rng.bit_generator.state, "random_state": random.getstate(),
+        "numpy_random_state": [npState[0], npState[1].tolist()]+list(npState[2:])}
+        self.replace("meta.json", lambda f: f.write(json.dumps(meta, default=int).encode()))
+
+    def load(self):
+        # Restores the run saved in self.directory into self.sim, which must have been
+        # created with the same settings (and not initialized).
+        sim = self.sim
+        with open(self.getPath("meta.json")) as f:
+            meta = json.load(f)
+        expected = {"c_count": sim.c_count, "c_dim": [sim.CW,sim.CH], "trait_count": sim.trait_count, "float_type": sim.float_type.name, "percentile_resolution": sim.HUNDRED}
+        for key in expected:
+            if meta[key] != expected[key]:
+                raise ValueError(f"This checkpoint was saved with {key} = {meta[key]}, but the Sim has {expected[key]}")
+        G = meta["generations"]
+        C = sim.c_count
+
+        sim.creatures = History(sim, sim.hot_generations, self.directory)
+        sim.creatures.resume(G)
+        with np.load(self.getPath("newest.npz")) as newest:
+            generation = Generation(sim, G, newest["dna"], newest["species"])
+            generation.codonWithChange[:] = newest["codonWithChange"]
+            generation.saveCalmStates(newest["calmStates"], 0)
+        sim.creatures.append(generation)
+
+        sim.rankings = GrowableArray((C,), int, max(2*G,16))
+        sim.rankings.extend(np.fromfile(self.getPath("rankings.bin"), dtype=np.int64, count=G*C).reshape((G,C)))
+        sim.percentiles = GrowableArray((sim.HUNDRED+1,), float, max(2*G,16))
+        sim.percentiles.extend(np.fromfile(self.getPath("percentiles.bin"), dtype=np.float64, count=G*(sim.HUNDRED+1)).reshape((G,sim.HUNDRED+1)))
+        sim.species_pops = GrowableArray((), object, max(2*G,16))
+        with open(self.getPath("species_pops.jsonl")) as f:
+            for g in range(G):
+                sim.species_pops.append(SpeciesPops(*json.loads(f.readline())))
+            popsBytes = f.tell()
+        # drop anything appended after meta.json was written
+        os.truncate(self.getPath("rankings.bin"), G*C*8)
+        os.truncate(self.getPath("percentiles.bin"), G*(sim.HUNDRED+1)*8)
+        os.truncate(self.getPath("species_pops.jsonl"), popsBytes)
+        self.saved = G
+
+        sim.species_info = []
+        with np.load(self.getPath("species.npz")) as f:
+            species = dict(f)
+            for s in range(len(species["level"])):
+                info = SpeciesInfo(sim, sim.getCreatureWithID(species["reps"][s][1]), None)
+                info.ancestorID = None if species["ancestorID"][s] < 0 else int(species["ancestorID"][s])
+                info.level = int(species["level"][s])
+                info.apex_pop = int(species["apex_pop"][s])
+                info.reps[:] = species["reps"][s]
+                info.prominent = bool(species["prominent"][s])
+                sim.species_info.append(info)
+        sim.species_count = meta["species_count"]
+        sim.prominent_species = meta["prominent_species"]
+        sim.last_gen_run_time = meta["last_gen_run_time"]
+
+        sim.rng.bit_generator.state = meta["rng_state"]
+        version, state, gauss = meta["random_state"]
+        random.setstate((version, tuple(state), gauss))
+        name, keys, pos, has_gauss, cached_gaussian = meta["numpy_random_state"]
+        np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+        return sim
+
+    def replace(self, name, write):
+        # Writes a file next to its old version first, so a crash never leaves it half-written
+        path = self.getPath(name)
+        with open(path+".tmp", "wb") as f:
+            write(f)
+        os.replace(path+".tmp", path)
+
+    def getPath(self, name):
+        return os.path.join(self.directory, name)
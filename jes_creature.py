@@ -1,31 +1,52 @@
-import pygame
-from utils import arrayLerp, dist_to_text, speciesToColor, listLerp, lerp
+try:
+    import pygame
+except ImportError: # headless runs (jes_headless.py) never draw, so they don't need pygame
+    pygame = None
+from utils import arrayLerp, dist_to_text, speciesToColor, listLerp, lerp, getIconTransform
 from jes_shapes import drawRect, drawTextRect, centerText, drawClock
 import numpy as np
 import math
 from jes_species_info import SpeciesInfo
-import random
 
 class Creature:
-    def __init__(self,d,pIDNumber,parent_species,_sim,_ui):
-        self.dna = d
-        self.calmState = None
-        self.icons = [None]*2
-        self.iconCoor = None
+    # A thin view onto one row of a Generation (see jes_generation.py): all of the
+    # creature's data lives in its generation's NumPy columns.
+    def __init__(self,pIDNumber,_sim,_ui):
         self.IDNumber = pIDNumber
-        self.fitness = None
-        self.rank = None
-        self.living = True
-        self.species = self.getSpecies(parent_species)
         self.sim = _sim
         self.ui = _ui
-        self.codonWithChange = None
+        self.generation = self.sim.creatures[self.IDNumber//self.sim.c_count]
+        self.row = self.IDNumber%self.sim.c_count
     
-    def getSpecies(self, parent_species):
-        if parent_species == -1:
-            return self.IDNumber
-        else:
-            return parent_species
+    @property
+    def dna(self):
+        return self.generation.dna[self.row]
+    
+    @property
+    def species(self):
+        return int(self.generation.species[self.row])
+    
+    @property
+    def calmState(self):
+        return self.generation.calmStates[self.row] if self.generation.calmed else None
+    
+    @property
+    def fitness(self):
+        return None if self.rank is None else float(self.generation.fitness[self.row])
+    
+    @property
+    def rank(self):
+        rank = self.generation.rank[self.row]
+        return None if rank < 0 else int(rank)
+    
+    @property
+    def living(self):
+        return bool(self.generation.living[self.row])
+    
+    @property
+    def codonWithChange(self):
+        codon = self.generation.codonWithChange[self.row]
+        return None if codon < 0 else int(codon)
     
     def drawCell(self,surface,nodeState,frame,transform,x,y):
         tx,ty,s = transform
@@ -57,6 +78,7 @@ class Creature:
         drawRect(surface,transform,[None,0,None,None],WHITE)
 
     def drawCreature(self, surface, nodeState, frame, transform, drawLabels, shouldDrawClock):
+        nodeState = np.asarray(nodeState, dtype=np.float64) # pygame rejects float32 coordinates (float32 sims, recorded replays)
         if drawLabels:
             self.drawEnvironment(surface,nodeState,frame,transform)
             
@@ -86,42 +108,13 @@ class Creature:
     def drawIcon(self, ICON_DIM, BG_COLOR, BEAT_FADE_TIME):
         icon = pygame.Surface(ICON_DIM, pygame.SRCALPHA, 32)
         icon.fill(BG_COLOR)
-        transform = [ICON_DIM[0]/2,ICON_DIM[0]/(self.sim.CW+2),ICON_DIM[0]/(self.sim.CH+2.85)]
+        transform = getIconTransform(ICON_DIM[0],self.sim.CW,self.sim.CH)
         self.drawCreature(icon,self.calmState,BEAT_FADE_TIME,transform,False,False)
         R = ICON_DIM[0]*0.09
         R2 = ICON_DIM[0]*0.12
         pygame.draw.circle(icon,speciesToColor(self.species, self.ui),(ICON_DIM[0]-R2,R2),R)
         return icon
         
-    def saveCalmState(self, arr):
-        self.calmState = arr
-        
-    def getMutatedDNA(self, sim):
-        mutation = np.clip(np.random.normal(0.0, 1.0, self.dna.shape[0]),-99,99)
-        result = self.dna + sim.mutation_rate*mutation
-        newSpecies = self.species
-        
-        big_mut_loc = 0
-        if random.uniform(0,1) < self.sim.big_mutation_rate: # do a big mutation
-            newSpecies = sim.species_count
-            sim.species_count += 1
-            cell_x = random.randint(0,self.sim.CW-1)
-            cell_y = random.randint(0,self.sim.CH-1)
-            cell_beat = random.randint(0,self.sim.beats_per_cycle-1)
-            
-            big_mut_loc = (cell_x*self.sim.CH*self.sim.beats_per_cycle+cell_y*self.sim.beats_per_cycle+cell_beat)*self.sim.traits_per_box
-            for i in range(self.sim.traits_per_box):
-                delta = 0
-                while abs(delta) < 0.5:
-                    delta = np.random.normal(0.0, 1.0, 1)
-                result[big_mut_loc+i] += delta
-                
-                #Cells that endure a big mutation are also required to be at least somewhat rigid, because if a cell goes from super-short to super-tall but has low rigidity the whole time, then it doesn't really matter.
-                if i == 2 and result[big_mut_loc+i] < 0.5:
-                    result[big_mut_loc+i] = 0.5
-        
-        return result, newSpecies, big_mut_loc
-        
     def traitsToColor(self, dna, x, y, frame):
         beat = self.sim.frameToBeat(frame)
         beat_prev = (beat+self.sim.beats_per_cycle-1)%self.sim.beats_per_cycle
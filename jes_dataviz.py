@@ -4,14 +4,26 @@ from jes_shapes import centerText, rightText, alignText, drawArrow, drawSpeciesC
 import math
 import pygame
 import random
-import bisect
+from jes_envelope import Envelope
+
+PERCENTILES_SHOWN = [0,1,2,3,4,5,6,7,8,9,10,20,30,40,50,60,70,80,90,91,92,93,94,95,96,97,98,99,100]
+
+def getPercentilesShown(hundred):
+    # PERCENTILES_SHOWN as columns of sim.percentiles, which has hundred+1 of them
+    return sorted(set(p*hundred//100 for p in PERCENTILES_SHOWN))
 
 def drawAllGraphs(sim, ui):
-    drawLineGraph(sim.percentiles, ui.graph, [70,0,30,30], sim.UNITS_PER_METER, ui.smallFont)
+    if ui.graphEnvelope is None:
+        ui.graphEnvelope = Envelope(getPercentilesShown(sim.HUNDRED), ui.graph.get_width()-70)
+    ui.graphEnvelope.update(sim.percentiles)
+    drawLineGraph(ui.graphEnvelope, ui.graph, [70,0,30,30], sim.UNITS_PER_METER, ui.smallFont, sim.HUNDRED)
     drawSAC(sim.species_pops, ui.sac, [70,0], ui)
     drawGeneGraph(sim.species_info, sim.prominent_species, ui.gene_graph, sim, ui, ui.tinyFont)
 
-def drawLineGraph(data,graph,margins,u,font):
+def drawLineGraph(envelope,graph,margins,u,font,hundred=100):
+    # envelope summarizes the data (see jes_envelope.py). While each generation still gets its own bucket,
+    # this draws exactly one line per generation per percentile. Once they're merged, each bucket gets
+    # a line from the previous bucket's last value to its own, plus a vertical line spanning its min to max.
     BLACK = (0,0,0)
     GRAY25 = (70,70,70)
     GRAY50 = (128,128,128)
@@ -25,8 +37,8 @@ def drawLineGraph(data,graph,margins,u,font):
     RIGHT = graph.get_width()-margins[1]
     BOTTOM = graph.get_height()-margins[3]
     
-    minVal = np.amin(data)
-    maxVal = np.amax(data)
+    minVal = envelope.minVal
+    maxVal = envelope.maxVal
     unit = getUnit((maxVal-minVal)/u)*u
     tick = math.floor(minVal/unit)*unit-unit
     while tick <= maxVal+unit:
@@ -36,71 +48,84 @@ def drawLineGraph(data,graph,margins,u,font):
         tick += unit
         
     
-    toShow = [0,1,2,3,4,5,6,7,8,9,10,20,30,40,50,60,70,80,90,91,92,93,94,95,96,97,98,99,100]
-    LEN = len(data)
-    for g in range(LEN):
-        for p in toShow:
-            prevVal = 0 if g == 0 else data[g-1][p]
-            nextVal = data[g][p]
+    toShow = envelope.columns
+    LEN = envelope.count
+    lasts = np.asarray(envelope.lasts).tolist() # plain floats are much quicker to index one by one
+    mins = np.asarray(envelope.mins).tolist()
+    maxs = np.asarray(envelope.maxs).tolist()
+    for i in range(len(envelope)):
+        start, end = envelope.getBucketRange(i)
+        for j in range(len(toShow)):
+            p = toShow[j]
+            prevVal = 0 if i == 0 else lasts[i-1][j]
+            nextVal = lasts[i][j]
             
-            x1 = LEFT+(g/LEN)*W
-            x2 = LEFT+((g+1)/LEN)*W
+            x1 = LEFT+(start/LEN)*W
+            x2 = LEFT+(end/LEN)*W
             y1 = BOTTOM-H*(prevVal-minVal)/(maxVal-minVal)
             y2 = BOTTOM-H*(nextVal-minVal)/(maxVal-minVal)
             
-            IMPORTANT = (p%10 == 0)
+            IMPORTANT = (p*10%hundred == 0) # every 10%
             thickness = 2 if IMPORTANT else 1
             color = WHITE if IMPORTANT else GRAY50
-            if p == 50:
+            if p*2 == hundred:
                 color = RED
                 thickness = 3
             pygame.draw.line(graph, color, (x1, y1), (x2, y2), width=thickness)
+            if end-start >= 2:
+                yMin = BOTTOM-H*(mins[i][j]-minVal)/(maxVal-minVal)
+                yMax = BOTTOM-H*(maxs[i][j]-minVal)/(maxVal-minVal)
+                pygame.draw.line(graph, color, (x2, yMin), (x2, yMax), width=thickness)
             
 def drawSAC(data,sac,margins,ui):
-    sac.fill((0,0,0))
-    for g in range(len(data)):
-        scanDownTrapezoids(data, g, sac, margins, ui)
-        
-def scanDownTrapezoids(data, g, sac, margins, ui):
+    # Each generation is drawn only once, into ui.sacStrip: a strip up to 4x wider than the chart
+    # where every generation gets the same width. When the strip fills up, its history gets squeezed
+    # into half the width, and the chart itself is just the strip scaled down to fit.
+    BLACK = (0,0,0)
     W = sac.get_width()-margins[0]-margins[1]
     H = sac.get_height()
-    LEN = len(data)
     LEFT = margins[0]
-    RIGHT = sac.get_width()-margins[1]
-    x1 = LEFT+(g/LEN)*W
-    x2 = LEFT+((g+1)/LEN)*W
-    keys = sorted(list(data[g].keys()))
-    c_count = data[g][keys[-1]][2] # ending index of the last entry
+    CAPACITY = 4*W
+    if ui.sacStrip is None or len(data) < ui.sacDrawn: # nothing drawn yet, or the history was replaced
+        ui.sacStrip = pygame.Surface((CAPACITY,H), pygame.SRCALPHA, 32)
+        ui.sacStrip.fill(BLACK)
+        ui.sacDrawn = 0
+        ui.sacGenW = W
+    for g in range(ui.sacDrawn, len(data)):
+        if (g+1)*ui.sacGenW > CAPACITY:
+            used = math.ceil(g*ui.sacGenW)
+            squeezed = pygame.transform.smoothscale(ui.sacStrip.subsurface((0,0,used,H)), (math.ceil(used/2),H))
+            ui.sacStrip.fill(BLACK)
+            ui.sacStrip.blit(squeezed, (0,0))
+            ui.sacGenW /= 2
+        scanDownTrapezoids(data, g, ui.sacStrip, g*ui.sacGenW, (g+1)*ui.sacGenW, ui)
+    ui.sacDrawn = len(data)
+    
+    sac.fill(BLACK)
+    if len(data) >= 1:
+        used = min(math.ceil(len(data)*ui.sacGenW), CAPACITY)
+        sac.blit(pygame.transform.smoothscale(ui.sacStrip.subsurface((0,0,used,H)), (W,H)), (LEFT,0))
+        
+def scanDownTrapezoids(data, g, sac, x1, x2, ui):
+    # draws generation g's species populations between x1 and x2
+    H = sac.get_height()
+    c_count = data[g].getTotal()
     FAC = H/c_count
 
     if g == 0:
-        for sp in data[g].keys():
-            pop = data[g][sp]
+        for sp, pop in data[g].items():
             points = [[x1,H/2],[x1,H/2],[x2,H-pop[1]*FAC],[x2,H-pop[2]*FAC]]
             pygame.draw.polygon(sac,speciesToColor(sp, ui),points)
     else:
         trapezoidHelper(sac, data, g, g-1, 0, c_count, x1, x2, FAC, 0, ui)
    
-def getRangeEvenIfNone(dicty, key):
-    keys = sorted(list(dicty.keys()))
-    if key in keys:
-        return dicty[key]
-    else:
-        n = bisect.bisect(keys, key+0.5)
-        if n >= len(keys):
-            val = dicty[keys[n-1]][2]
-        else:
-            val = dicty[keys[n]][1]
-        return [0,val,val]
-
 def trapezoidHelper(sac, data, g1, g2, i_start, i_end, x1, x2, FAC, level, ui):
     pop2 = [0,0,0]
     H = sac.get_height()
-    for sp in data[g1].keys():
-        pop1 = data[g1][sp]
+    for sp, pop1 in data[g1].items():
         if level == 0 and pop1[1] != pop2[2]: #there was a gap
             trapezoidHelper(sac, data, g2, g1, pop2[2], pop1[1], x2, x1, FAC, 1, ui)
-        pop2 = getRangeEvenIfNone(data[g2],sp)
+        pop2 = data[g2].getRangeEvenIfNone(sp)
         points = [[x1,H-pop2[1]*FAC],[x1,H-pop2[2]*FAC],[x2,H-pop1[2]*FAC],[x2,H-pop1[1]*FAC]]
         pygame.draw.polygon(sac,speciesToColor(sp, ui),points)
         
@@ -152,12 +177,11 @@ def blitGraphsandMarks(screen, sim, ui):
     
     frac = (a2+1)/b
     lineX = ui.SAC_COOR[0]+70+(ui.graph.get_width()-70)*frac
-    median = sim.percentiles[a2][50]
+    median = sim.percentiles[a2][sim.HUNDRED//2]
     rightText(screen, f"Median: {dist_to_text(median, True, sim.UNITS_PER_METER)}", 1800,28, WHITE, ui.smallFont)
     
     top_species = getTopSpecies(sim, a2)
-    for sp in sim.species_pops[a2].keys():
-        pop = sim.species_pops[a2][sp]
+    for sp, pop in sim.species_pops[a2].items():
         if pop[0] >= sim.c_count*sim.S_VISIBLE:
             speciesI = (pop[1]+pop[2])/2
             speciesY = 560+300*(1-speciesI/sim.c_count)
@@ -182,7 +206,6 @@ def blitGGandMarks(screen, sim, ui):
         info = sim.species_info[sp]
         if not info.prominent:
             continue
-        pop = sim.species_pops[a2][sp][0]
         circle_count = 2 if sp == top_species else 1
         cx = info.coor[0]+ui.GENEALOGY_COOR[0]
         cy = info.coor[1]+ui.GENEALOGY_COOR[1]
@@ -202,5 +225,4 @@ def blitGGandMarks(screen, sim, ui):
     
         
 def getTopSpecies(sim, g):
-    data = sim.species_pops[g] 
-    return max(data, key=data.get)
\ No newline at end of file
+    return sim.species_pops[g].top
\ No newline at end of file
@@ -0,0 +1,69 @@
+import numpy as np
+from jes_growable import GrowableArray
+
+class Envelope:
+    # A level-of-detail summary of a per-generation table (sim.percentiles) for the line graph:
+    # consecutive generations are grouped into buckets of bucketSize, and each bucket keeps
+    # the min, max and last value of every column shown. Once there are more buckets than
+    # maxBuckets (the graph's width in pixels), neighbouring buckets are merged pairwise,
+    # so drawing costs at most about one line per pixel column however long the run gets.
+    def __init__(self, columns, maxBuckets):
+        self.columns = columns
+        self.maxBuckets = max(maxBuckets,1)
+        self.reset()
+
+    def reset(self):
+        P = len(self.columns)
+        self.bucketSize = 1
+        self.count = 0 # generations summarized so far
+        self.mins = GrowableArray((P,), float)
+        self.maxs = GrowableArray((P,), float)
+        self.lasts = GrowableArray((P,), float)
+        self.minVal = np.inf # over every column, not just the shown ones, for the graph's scale
+        self.maxVal = -np.inf
+
+    def update(self, data):
+        # adds the generations of data that haven't been added yet
+        if len(data) < self.count: # the history was replaced
+            self.reset()
+        for g in range(self.count, len(data)):
+            self.add(data[g])
+
+    def add(self, row):
+        values = row[self.columns]
+        self.minVal = min(self.minVal, np.amin(row))
+        self.maxVal = max(self.maxVal, np.amax(row))
+        if self.count%self.bucketSize == 0: # the last bucket is full
+            self.mins.append(values)
+            self.maxs.append(values)
+            self.lasts.append(values)
+        else:
+            self.mins[-1] = np.minimum(self.mins[-1], values)
+            self.maxs[-1] = np.maximum(self.maxs[-1], values)
+            self.lasts[-1] = values
+        self.count += 1
+        if len(self.mins) > self.maxBuckets:
+            self.mergePairs()
+
+    def mergePairs(self):
+        # Every bucket but the last is full, so merging (0,1), (2,3)... keeps that true at twice the size.
+        n = len(self.mins)
+        pairs = n//2
+        mins = np.minimum(self.mins[0:2*pairs:2], self.mins[1:2*pairs:2])
+        maxs = np.maximum(self.maxs[0:2*pairs:2], self.maxs[1:2*pairs:2])
+        lasts = self.lasts[1:2*pairs:2]
+        if n%2 == 1: # the odd one out is the last bucket, and it stays as it is
+            mins = np.append(mins, self.mins[-1:], axis=0)
+            maxs = np.append(maxs, self.maxs[-1:], axis=0)
+            lasts = np.append(lasts, self.lasts[-1:], axis=0)
+        for table, merged in [(self.mins, mins), (self.maxs, maxs), (self.lasts, lasts)]:
+            table.length = 0
+            table.extend(merged)
+        self.bucketSize *= 2
+
+    def __len__(self):
+        return len(self.mins)
+
+    def getBucketRange(self, i):
+        # the generations bucket i summarizes: [start, end)
+        return i*self.bucketSize, min((i+1)*self.bucketSize, self.count)
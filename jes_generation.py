@@ -0,0 +1,43 @@
+import numpy as np
+from jes_creature import Creature
+
+class Generation:
+    # All the per-creature data of one generation, stored column by column as NumPy arrays.
+    # sim.creatures[gen] is a Generation, and sim.creatures[gen][c] hands out a Creature,
+    # which is just a thin view onto row c of these columns.
+    def __init__(self, sim, gen, dna, species, columns=None):
+        C = sim.c_count
+        self.sim = sim
+        self.gen = gen
+        self.dna = dna # (c_count, trait_count)
+        self.species = species
+        if columns is not None: # an already finished generation, e.g. read back from disk (see jes_history.py)
+            self.calmStates = columns["calmStates"]
+            self.calmed = True
+            self.fitness = columns["fitness"]
+            self.rank = columns["rank"]
+            self.living = columns["living"]
+            self.codonWithChange = columns["codonWithChange"]
+            return
+        self.calmStates = np.zeros((C,sim.CW+1,sim.CH+1,sim.node_coor_count), dtype=sim.float_type)
+        self.calmed = False # the calm states are only valid once the calming run is done
+        self.fitness = np.full(C, np.nan) # NaN and -1 mean "untested"
+        self.rank = np.full(C, -1, dtype=int)
+        self.living = np.ones(C, dtype=bool)
+        self.codonWithChange = np.full(C, -1, dtype=int) # where a big mutation happened (-1 if none)
+
+    def __len__(self):
+        return len(self.species)
+
+    def __getitem__(self, c):
+        if c < 0 or c >= len(self):
+            raise IndexError(c)
+        return Creature(self.gen*self.sim.c_count+c, self.sim, self.sim.ui)
+
+    def saveCalmStates(self, nodeCoor, startIndex):
+        self.calmStates[startIndex:startIndex+len(nodeCoor)] = nodeCoor
+        self.calmed = True
+
+    def saveResults(self, finalScores, currRankings):
+        self.fitness[:] = finalScores
+        self.rank[currRankings] = np.arange(len(currRankings))
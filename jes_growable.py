@@ -0,0 +1,58 @@
+import numpy as np
+
+class GrowableArray:
+    # A per-generation table (sim.rankings, sim.percentiles, sim.species_pops) that
+    # grows one row at a time. np.append copies the whole table every generation;
+    # this keeps spare capacity and only copies when it runs out (doubling it), so
+    # appending is amortized O(row). Reading it works like the NumPy array of the
+    # rows appended so far: len(), [g], [g][p], [a:b], and np.* functions.
+    def __init__(self, rowShape=(), dtype=float, capacity=16):
+        self.data = np.zeros((capacity,)+tuple(rowShape), dtype=dtype)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        return self.data[:self.length][key]
+
+    def __setitem__(self, key, value):
+        self.data[:self.length][key] = value
+
+    def __iter__(self):
+        return iter(self.data[:self.length])
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.data[:self.length]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array.copy() if copy else array
+
+    def append(self, row):
+        if self.length == len(self.data):
+            self.reserve(self.length*2)
+        self.data[self.length] = row
+        self.length += 1
+
+    def extend(self, rows):
+        if self.length+len(rows) > len(self.data):
+            self.reserve(max(self.length*2, self.length+len(rows)))
+        if self.data.dtype == object: # one at a time, so rows like dicts go in as they are
+            for i in range(len(rows)):
+                self.data[self.length+i] = rows[i]
+        else:
+            self.data[self.length:self.length+len(rows)] = rows
+        self.length += len(rows)
+
+    def reserve(self, capacity):
+        bigger = np.zeros((max(capacity,1),)+self.data.shape[1:], dtype=self.data.dtype)
+        bigger[:self.length] = self.data[:self.length]
+        self.data = bigger
+
+    @property
+    def shape(self):
+        return (self.length,)+self.data.shape[1:]
+
+    @property
+    def nbytes(self):
+        return self.data[:self.length].nbytes
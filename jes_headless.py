@@ -0,0 +1,210 @@
+import os
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+import argparse
+import json
+import random
+import time
+import numpy as np
+from jes_sim import Sim
+from jes_profiler import Profiler
+
+# Headless batch runner: evolves generations with no UI (and no pygame) attached
+# to the Sim, and writes the results to disk instead of drawing them.
+#
+#   python jes_headless.py --creatures 250 --generations 1000 --out runs/overnight --seed 1
+#
+# or from Python:
+#
+#   sim = createSim(250)
+#   runHeadless(sim, 1000, "runs/overnight")
+
+def createSim(c_count, float_type=np.float64, workers=1, hot_generations=None, history_dir=None, checkpoint_dir=None, c_dim=(4,4), percentile_resolution=100,
+memoize_fitness=False, memoize_check=0.0):
+    # Same settings as jes.py, so headless results are comparable to the windowed ones.
+    return Sim(_c_count=c_count, _stabilization_time=200, _trial_time=300,
+    _beat_time=20, _beat_fade_time=5, _c_dim=list(c_dim),
+    _beats_per_cycle=3, _node_coor_count=4, # x_position, y_position, x_velocity, y_velocity
+    _y_clips=[-10000000,0], _ground_friction_coef=25,
+    _gravity_acceleration_coef=0.002, _calming_friction_coef=0.7,
+    _typical_friction_coef=0.8, _muscle_coef=0.08,
+    _traits_per_box=3, # desired width, desired height, rigidity
+    _traits_extra=1, # heartbeat (time)
+    _mutation_rate=0.07, _big_mutation_rate=0.025,
+    _UNITS_PER_METER=0.05, _float_type=float_type, _workers=workers,
+    _hot_generations=hot_generations, _history_dir=history_dir, _checkpoint_dir=checkpoint_dir,
+    _percentile_resolution=percentile_resolution, _memoize_fitness=memoize_fitness, _memoize_check=memoize_check)
+
+def seedEverything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+def runHeadless(sim, generations, outDir, saveEvery=50, verbose=True):
+    # outDir can be None to keep the results in memory only
+    if outDir is not None:
+        os.makedirs(outDir, exist_ok=True)
+    if sim.creatures is None:
+        if sim.checkpoint is not None and sim.checkpoint.exists():
+            sim.checkpoint.load()
+        else:
+            sim.initializeUniverse()
+            if outDir is not None: # a brand new run: whatever an older run left in outDir is stale
+                clearResults(outDir)
+    runTimes = []
+    for g in range(generations):
+        sim.doGeneration(None)
+        runTimes.append(sim.last_gen_run_time)
+        if verbose:
+            gen = len(sim.creatures)-2
+            print(f"Generation {gen}: median {sim.percentiles[gen][sim.HUNDRED//2]:.3f}, best {sim.percentiles[gen][0]:.3f} ({sim.last_gen_run_time:.3f}s)")
+        if outDir is not None and ((g+1)%saveEvery == 0 or g == generations-1):
+            saveResults(sim, outDir, runTimes)
+    return sim
+
+# Results files: one row per finished generation, appended as raw bytes (like jes_checkpoint.py),
+# so a save only writes the generations that are new since the last one. summary.json is
+# written last and says how many rows are complete; loadResults reads everything back.
+RESULT_COLUMNS = {"percentiles": np.float64, "rankings": np.int64, "fitness": np.float64, "species": np.int64}
+
+def getResultRows(sim, column, start, end):
+    if column == "percentiles":
+        return sim.percentiles[start:end]
+    if column == "rankings":
+        return sim.rankings[start:end]
+    return [getattr(sim.creatures[g], column) for g in range(start, end)]
+
+def saveResults(sim, outDir, runTimes):
+    # Only finished (tested) generations are saved. The newest generation hasn't been simulated yet.
+    G = len(sim.rankings)
+    summaryPath = os.path.join(outDir,"summary.json")
+    saved, popsBytes = 0, 0
+    if os.path.exists(summaryPath):
+        with open(summaryPath) as f:
+            old = json.load(f)
+        saved, popsBytes = min(old["generations"], G), old["species_pops_bytes"]
+    for column, dtype in RESULT_COLUMNS.items():
+        path = os.path.join(outDir,column+".bin")
+        rowShape = (sim.HUNDRED+1,) if column == "percentiles" else (sim.c_count,)
+        if os.path.exists(path): # drop anything appended after summary.json was written
+            os.truncate(path, saved*rowShape[0]*np.dtype(dtype).itemsize)
+        with open(path, "ab") as f:
+            if G > saved:
+                f.write(np.ascontiguousarray(getResultRows(sim, column, saved, G), dtype=dtype).tobytes())
+    popsPath = os.path.join(outDir,"species_pops.jsonl")
+    if os.path.exists(popsPath):
+        os.truncate(popsPath, popsBytes)
+    with open(popsPath, "a") as f:
+        for g in range(saved, G):
+            f.write(json.dumps(dict(zip(map(str, sim.species_pops[g].species), sim.species_pops[g].pops)))+"\n")
+        popsBytes = f.tell()
+    summary = {"generations": G, "c_count": sim.c_count, "percentile_resolution": sim.HUNDRED,
+    "species_count": sim.species_count, "gen_run_times": runTimes,
+    "prominent_species": sim.prominent_species, "species_pops_bytes": popsBytes}
+    with open(summaryPath+".tmp", "w") as f:
+        json.dump(summary, f, default=int)
+    os.replace(summaryPath+".tmp", summaryPath)
+
+def loadResults(outDir):
+    # Everything saveResults wrote to outDir, as {"percentiles": (G, H+1) array, ..., "species_pops": list, "summary": dict}
+    with open(os.path.join(outDir,"summary.json")) as f:
+        summary = json.load(f)
+    G = summary["generations"]
+    results = {"summary": summary}
+    for column, dtype in RESULT_COLUMNS.items():
+        width = summary["percentile_resolution"]+1 if column == "percentiles" else summary["c_count"]
+        results[column] = np.fromfile(os.path.join(outDir,column+".bin"), dtype=dtype, count=G*width).reshape((G,width))
+    with open(os.path.join(outDir,"species_pops.jsonl")) as f:
+        results["species_pops"] = [json.loads(f.readline()) for g in range(G)]
+    return results
+
+def clearResults(outDir):
+    for name in [column+".bin" for column in RESULT_COLUMNS]+["species_pops.jsonl","summary.json"]:
+        if os.path.exists(os.path.join(outDir,name)):
+            os.remove(os.path.join(outDir,name))
+
+def evaluatePopulation(sim, creatures, gen):
+    # Calms down and tests the DNA of creatures[gen] in sim's precision, without touching the creatures themselves.
+    sim.creatures = creatures
+    nodeCoor, muscles, _ = sim.simulateRun(sim.simulateImport(gen, 0, sim.c_count, False), sim.stabilization_time, True)
+    nodeCoor[:,:,:,1] -= sim.CH  # lift the creatures above ground level, like getStartingNodeCoor does
+    nodeCoor, _, _ = sim.simulateRun((nodeCoor, muscles, 0), sim.trial_time, False)
+    return nodeCoor[:,:,:,0].mean(axis=(1, 2))
+
+def precisionDriftReport(c_count, generations, seed=0):
+    # Evolves a float64 run, then re-tests every one of its generations in float32,
+    # and reports how far the float32 fitnesses and rankings drift from the float64 ones.
+    seedEverything(seed)
+    sim64 = createSim(c_count, np.float64)
+    runHeadless(sim64, generations, None, verbose=False)
+    sim32 = createSim(c_count, np.float32)
+    report = []
+    for gen in range(len(sim64.rankings)):
+        fitness64 = sim64.creatures[gen].fitness
+        fitness32 = evaluatePopulation(sim32, sim64.creatures, gen).astype(np.float64)
+        rankings32 = np.flip(np.argsort(fitness32),axis=0)
+        rank64 = np.argsort(sim64.rankings[gen])
+        rank32 = np.argsort(rankings32)
+        survivors64 = set(sim64.rankings[gen][:c_count//2])
+        survivors32 = set(rankings32[:c_count//2])
+        report.append({"generation": gen,
+        "max_fitness_error": float(np.amax(np.abs(fitness32-fitness64))),
+        "mean_fitness_error": float(np.mean(np.abs(fitness32-fitness64))),
+        "rank_correlation": float(np.corrcoef(rank64, rank32)[0,1]), # Spearman's rho
+        "creatures_with_same_rank": int(np.sum(rank64 == rank32)),
+        "same_winner": bool(sim64.rankings[gen][0] == rankings32[0]),
+        "top_half_changes": len(survivors64-survivors32)})
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Jelly Evolution Simulator without a window.")
+    parser.add_argument("--creatures", type=int, default=250, help="population size (c_count)")
+    parser.add_argument("--generations", type=int, default=100, help="how many generations to evolve")
+    parser.add_argument("--out", default="jes_output", help="directory the results are written to")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible runs")
+    parser.add_argument("--save-every", type=int, default=50, help="write results to disk every N generations")
+    parser.add_argument("--quiet", action="store_true", help="don't print a line per generation")
+    parser.add_argument("--workers", type=int, default=1, help="processes to shard each generation across")
+    parser.add_argument("--float32", action="store_true", help="simulate in float32 instead of float64")
+    parser.add_argument("--keep-generations", type=int, default=None, help="keep only the newest N generations in RAM and spill older ones to disk")
+    parser.add_argument("--history-dir", default=None, help="where spilled generations go (default: a temporary directory)")
+    parser.add_argument("--checkpoint", default=None, help="save the run here after every generation, and resume from it if it's already there")
+    parser.add_argument("--body", default="4x4", help="creature size in cells, width x height (e.g. 16x16 or 32x8)")
+    parser.add_argument("--percentile-resolution", type=int, default=100, help="how finely percentiles are tracked (1000: every per-mille)")
+    parser.add_argument("--memoize-fitness", action="store_true", help="don't re-test clones: reuse the fitness of an identical genome and calm state")
+    parser.add_argument("--memoize-check", type=float, default=0.0, help="with --memoize-fitness, re-test this fraction of the reused fitnesses and stop if any differ")
+    parser.add_argument("--profile", default=None, help="log how long each phase of every generation takes to this .csv or .jsonl file")
+    parser.add_argument("--profile-allocations", action="store_true", help="with --profile, also log the bytes each phase allocates (slower)")
+    parser.add_argument("--drift-report", action="store_true", help="instead of a normal run, report how float32 results drift from float64")
+    args = parser.parse_args()
+    if args.creatures < 2 or args.creatures%2 != 0:
+        parser.error("--creatures must be even and at least 2 (creatures are paired off to reproduce)")
+    if args.keep_generations is not None and args.keep_generations < 1:
+        parser.error("--keep-generations must be at least 1 (the newest generation is still being worked on)")
+
+    if args.drift_report:
+        report = precisionDriftReport(args.creatures, args.generations, 0 if args.seed is None else args.seed)
+        for row in report:
+            print(json.dumps(row))
+        return
+
+    if args.seed is not None:
+        seedEverything(args.seed)
+    sim = createSim(args.creatures, np.float32 if args.float32 else np.float64, args.workers, args.keep_generations, args.history_dir, args.checkpoint,
+    tuple(int(d) for d in args.body.split("x")), args.percentile_resolution, memoize_fitness=args.memoize_fitness, memoize_check=args.memoize_check)
+    if args.profile is not None:
+        sim.profiler = Profiler(args.profile_allocations, args.profile)
+    generations = args.generations
+    if sim.checkpoint is not None and sim.checkpoint.exists():
+        sim.checkpoint.load()
+        generations = max(args.generations-len(sim.rankings), 0) # --generations counts the whole run, resumed or not
+        print(f"Resumed from {args.checkpoint} after {len(sim.rankings)} generations")
+    start_time = time.time()
+    runHeadless(sim, generations, args.out, args.save_every, not args.quiet)
+    if sim.pool is not None:
+        sim.pool.close()
+    print(f"Ran {generations} generations in {time.time()-start_time:.1f}s. Results are in {args.out}")
+    if sim.profiler is not None:
+        summary = sim.profiler.getSummary()
+        print("Mean time per generation: "+", ".join(f"{name} {t*1000:.1f}ms" for name, t in summary.items() if t > 0))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+from collections import OrderedDict
+from jes_generation import Generation
+
+class History:
+    # sim.creatures: the list of Generations, except that only the newest `hotCount`
+    # stay in RAM. Older generations are finished (nothing writes to them any more),
+    # so they're written to one append-only file per column in `directory`, and
+    # reading one maps it back in read-only: sim.creatures[gen] works as before,
+    # and the OS pages the rows in (and out again) as they're actually used.
+    # hotCount=None keeps everything in RAM. The newest generation always stays hot,
+    # since it isn't finished (calmed and tested) yet.
+    COLUMNS = ["dna","species","calmStates","fitness","rank","living","codonWithChange"]
+
+    def __init__(self, sim, hotCount=None, directory=None):
+        self.sim = sim
+        self.hotCount = hotCount
+        self.directory = directory
+        self.hot = [] # the in-RAM Generations, oldest first
+        self.start = 0 # the generation number of hot[0]
+        self.written = 0 # generations 0..written-1 are on disk (see flush)
+        self.maps = {} # column name -> memmap of its whole file, as of when it was last opened
+        self.mapped = 0 # how many generations self.maps covers
+        self.views = OrderedDict() # recently read on-disk generations, so Creature views stay cheap
+        self.layout = None
+
+    def __len__(self):
+        return self.start+len(self.hot)
+
+    def __getitem__(self, gen):
+        if gen < 0:
+            gen += len(self)
+        if gen < 0 or gen >= len(self):
+            raise IndexError(gen)
+        if gen >= self.start:
+            return self.hot[gen-self.start]
+        if gen in self.views:
+            self.views.move_to_end(gen)
+            return self.views[gen]
+        if gen >= self.mapped:
+            self.openMaps()
+        C = self.sim.c_count
+        columns = {name: self.maps[name][gen*C:(gen+1)*C] for name in self.COLUMNS}
+        view = Generation(self.sim, gen, columns["dna"], columns["species"], columns)
+        self.views[gen] = view
+        while len(self.views) > 64:
+            self.views.popitem(last=False)
+        return view
+
+    def append(self, generation):
+        self.hot.append(generation)
+        while self.hotCount is not None and len(self.hot) > max(self.hotCount,1):
+            self.flush(self.start+1)
+            self.hot.pop(0)
+            self.start += 1
+
+    def flush(self, count):
+        # Writes generations up to count-1 to disk, if they aren't already. They must be finished.
+        if self.written >= count:
+            return
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="jes_history_")
+            weakref.finalize(self, shutil.rmtree, self.directory, True) # our own scratch space, so it goes away with us
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+        layout = self.getLayout()
+        for name in self.COLUMNS:
+            with open(self.getPath(name), "ab") as f:
+                for gen in range(self.written, count):
+                    column = getattr(self.hot[gen-self.start], name)
+                    f.write(np.ascontiguousarray(column, dtype=layout[name][1]).tobytes())
+        self.written = count
+
+    def resume(self, count):
+        # Picks up generations 0..count-1 from the files already in self.directory,
+        # dropping anything after them (e.g. half-written when the last run died).
+        layout = self.getLayout()
+        for name in self.COLUMNS:
+            shape, dtype = layout[name]
+            rowBytes = int(np.prod(shape, dtype=int))*np.dtype(dtype).itemsize
+            with open(self.getPath(name), "ab") as f:
+                f.truncate(count*self.sim.c_count*rowBytes)
+        self.hot = []
+        self.start = self.written = count
+        self.maps = {}
+        self.mapped = 0
+        self.views.clear()
+
+    def getLayout(self):
+        # column name -> (shape of one creature's row, dtype), as a fresh Generation has them
+        if self.layout is None:
+            C = self.sim.c_count
+            template = Generation(self.sim, 0, np.zeros((C,self.sim.trait_count)), np.zeros(C, dtype=int))
+            self.layout = {name: (getattr(template, name).shape[1:], getattr(template, name).dtype) for name in self.COLUMNS}
+        return self.layout
+
+    def openMaps(self):
+        # The files only ever grow, so older maps (and the views holding them) stay valid.
+        layout = self.getLayout()
+        rows = self.written*self.sim.c_count
+        for name in self.COLUMNS:
+            shape, dtype = layout[name]
+            self.maps[name] = np.memmap(self.getPath(name), dtype=dtype, mode="r", shape=(rows,)+shape)
+        self.mapped = self.written
+
+    def getPath(self, name):
+        return os.path.join(self.directory, name+".bin")
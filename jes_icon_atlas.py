@@ -0,0 +1,117 @@
+import numpy as np
+import pygame
+from utils import speciesToColor, getIconTransform
+
+# Batch icon renderer: instead of one pygame.draw.polygon per cell per creature
+# (Creature.drawIcon), the cell colors and quad corners of a whole batch of
+# creatures are computed with NumPy, and every icon is rasterized at once into
+# the pixel array of a single atlas surface, one icon next to the other.
+
+def getCellColors(sim, dna, codonWithChange, frame):
+    # Vectorized Creature.traitsToColor for every cell of every creature: returns (count, CW*CH, 4) RGBA,
+    # with cells in the order drawCreature draws them (x outer, y inner).
+    beat = sim.frameToBeat(frame)
+    beat_prev = (beat+sim.beats_per_cycle-1)%sim.beats_per_cycle
+    prog = sim.frameToBeatFade(frame)
+    T = sim.traits_per_box
+    locationIndex = np.arange(sim.CW*sim.CH)
+    DNAIndex = (locationIndex*sim.beats_per_cycle+beat)*T
+    DNAIndex_prev = (locationIndex*sim.beats_per_cycle+beat_prev)*T
+    traits = dna[:,DNAIndex[:,None]+np.arange(T)]
+    traits_prev = dna[:,DNAIndex_prev[:,None]+np.arange(T)]
+    traits = traits_prev+(traits-traits_prev)*prog
+
+    colors = np.empty(traits.shape[:2]+(4,))
+    colors[:,:,0] = np.clip(np.trunc(128+traits[:,:,0]*128),0,255)
+    colors[:,:,1] = np.clip(np.trunc(128+traits[:,:,1]*128),0,255)
+    colors[:,:,2] = 255
+    colors[:,:,3] = np.clip(np.trunc(155+traits[:,:,2]*100),64,255) #alpha can't go below 25%
+
+    # cells that went through a big mutation fade to green
+    codon = codonWithChange[:,None]
+    nextGreen = (codon >= DNAIndex) & (codon < DNAIndex+T)
+    prevGreen = (codon >= DNAIndex_prev) & (codon < DNAIndex_prev+T)
+    green_ness = (prevGreen+(nextGreen.astype(float)-prevGreen)*prog)[:,:,None]
+    colors += (np.array([0,255,0,255])-colors)*green_ness
+    return colors
+
+def getCellQuads(sim, nodeStates, transform):
+    # (count, CW*CH, 4, 2) pixel coordinates of each cell's 4 corners, in Creature.drawCell's order
+    tx, ty, s = transform
+    corners = [(0,0),(1,0),(1,1),(0,1)]
+    quads = np.empty((len(nodeStates),sim.CW,sim.CH,4,2))
+    for p in range(4):
+        dx, dy = corners[p]
+        quads[:,:,:,p,0] = tx+nodeStates[:,dx:dx+sim.CW,dy:dy+sim.CH,0]*s
+        quads[:,:,:,p,1] = ty+nodeStates[:,dx:dx+sim.CW,dy:dy+sim.CH,1]*s
+    return quads.reshape((len(nodeStates),sim.CW*sim.CH,4,2)).astype(np.float32) # plenty for pixels
+
+def rasterizeTopCells(quads, S):
+    # For every pixel of an SxS icon, the index+1 of the last-drawn cell covering it (0 = no cell).
+    # Each cell is only tested against the pixels of a small BW x BH window around it.
+    # Scanline fill: each quad crosses each pixel row 0, 2 or 4 times, and pixels between
+    # the 1st & 2nd or the 3rd & 4th crossing are inside (even-odd rule).
+    N, K, _, _ = quads.shape
+    x0 = np.clip(np.floor(np.amin(quads[:,:,:,0],axis=2)),0,S-1).astype(np.int32) # (N, K) window corners
+    y0 = np.clip(np.floor(np.amin(quads[:,:,:,1],axis=2)),0,S-1).astype(np.int32)
+    BW = min(max(int(np.ceil(np.amax(np.amax(quads[:,:,:,0],axis=2)-x0)))+1,1),S)
+    BH = min(max(int(np.ceil(np.amax(np.amax(quads[:,:,:,1],axis=2)-y0)))+1,1),S)
+    
+    rows = y0[:,:,None]+np.arange(BH, dtype=np.int32) # (N, K, BH)
+    columns = x0[:,:,None]+np.arange(BW, dtype=np.int32) # (N, K, BW)
+    y = (rows.astype(np.float32)+0.5)[:,:,None,:]
+    x1 = quads[:,:,:,0,None]
+    y1 = quads[:,:,:,1,None]
+    x2 = np.roll(quads[:,:,:,0],-1,axis=2)[:,:,:,None]
+    y2 = np.roll(quads[:,:,:,1],-1,axis=2)[:,:,:,None]
+    crosses = (y1 <= y) != (y2 <= y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xs = np.where(crosses, x1+(y-y1)*(x2-x1)/(y2-y1), np.inf)
+    xs = np.sort(xs, axis=2)[:,:,:,:,None] # (N, K, 4, BH, 1): the crossings of each row, left to right
+    x = (columns.astype(np.float32)+0.5)[:,:,None,:] # (N, K, 1, BW)
+    inside = ((x >= xs[:,:,0]) & (x <= xs[:,:,1])) | ((x >= xs[:,:,2]) & (x <= xs[:,:,3]))
+    inside &= (rows < S)[:,:,:,None] & (columns < S)[:,:,None,:]
+    
+    topCell = np.zeros((N,S,S), dtype=np.intp)
+    for k in range(K): # later cells are drawn over earlier ones
+        n, r, c = np.nonzero(inside[:,k])
+        topCell[n,rows[n,k,r],columns[n,k,c]] = k+1
+    return topCell
+
+def drawIconAtlas(sim, ui, generation, rows, ICON_DIM, BG_COLOR, frame, BATCH=32):
+    # Returns an atlas surface with the icons of generation[rows] side by side, each ICON_DIM[0] wide.
+    rows = np.asarray(rows, dtype=int)
+    S = ICON_DIM[0]
+    N = len(rows)
+    if N == 0:
+        return pygame.Surface((0,S), pygame.SRCALPHA, 32)
+    transform = getIconTransform(S,sim.CW,sim.CH) # same framing as Creature.drawIcon
+    atlas = pygame.Surface((S*N,S), pygame.SRCALPHA, 32)
+    shifts = atlas.get_shifts()
+    def pack(rgb): # opaque RGB -> the atlas' own 32-bit pixel format
+        rgb = rgb.astype(np.uint32)
+        return (rgb[...,0] << shifts[0]) | (rgb[...,1] << shifts[1]) | (rgb[...,2] << shifts[2]) | np.uint32(255 << shifts[3])
+
+    BG = np.array(BG_COLOR[:3])
+    pixels = np.empty((N,S,S), dtype=np.uint32) # (icon, x, y), since surfarrays are indexed [x][y]
+    for start in range(0,N,BATCH):
+        batch = rows[start:start+BATCH]
+        colors = getCellColors(sim, generation.dna[batch], generation.codonWithChange[batch], frame)
+        # blend each cell's color onto the background once, like blitting drawCreature's cellSurface onto the icon
+        alpha = colors[:,:,3:]/255
+        colors = pack(np.trunc(colors[:,:,:3]*alpha+BG*(1-alpha)))
+        colors = np.concatenate([np.full((len(batch),1),pack(BG)),colors], axis=1) # cell "0" is no cell at all
+        topCell = rasterizeTopCells(getCellQuads(sim, generation.calmStates[batch], transform), S)
+        topCell += (np.arange(len(batch))*colors.shape[1])[:,None,None]
+        pixels[start:start+len(batch)] = np.take(colors, topCell.transpose(0,2,1))
+
+    # species dot in the corner
+    R = S*0.09
+    R2 = S*0.12
+    xx, yy = np.mgrid[0:S,0:S]+0.5
+    dot = (np.square(xx-(S-R2))+np.square(yy-R2) <= R*R)
+    speciesColors = pack(np.array([speciesToColor(int(sp), ui) for sp in generation.species[rows]]))
+    pixels[:,dot] = speciesColors[:,None]
+
+    pygame.surfarray.pixels2d(atlas)[:] = pixels.reshape((S*N,S))
+    return atlas
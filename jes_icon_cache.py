@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from jes_icon_atlas import drawIconAtlas
+
+class IconCache:
+    # Creature icons, drawn only when something actually shows them (the mosaic,
+    # the genealogy graph, species circles) and kept in an LRU cache keyed by
+    # (creature ID, icon size). Once the icons take up more than maxBytes,
+    # the least recently used ones are dropped and get redrawn if needed again.
+    def __init__(self, ui, maxBytes):
+        self.ui = ui
+        self.maxBytes = maxBytes
+        self.icons = OrderedDict()
+        self.bytes = 0
+
+    def getIcon(self, creature, size):
+        # size is an index into ui.ICON_DIM (0: big icons, 1: small icons)
+        return self.getIcons(creature.generation, [creature.row], size)[0]
+
+    def getIcons(self, generation, rows, size):
+        # The icons of generation[rows]. The missing ones are all rasterized together
+        # into one atlas (see jes_icon_atlas), and each icon is copied out of it. A subsurface
+        # would keep the whole atlas alive, and self.bytes would only count a small part of it.
+        C = self.ui.sim.c_count
+        keys = [(generation.gen*C+c, size) for c in rows]
+        missing = [c for c, key in zip(rows, keys) if key not in self.icons]
+        if len(missing) >= 1:
+            S = self.ui.ICON_DIM[size][0]
+            with self.ui.sim.phase("icons"):
+                atlas = drawIconAtlas(self.ui.sim, self.ui, generation, missing, self.ui.ICON_DIM[size], self.ui.MOSAIC_COLOR, self.ui.sim.beat_fade_time)
+            for i in range(len(missing)):
+                icon = atlas.subsurface((i*S,0,S,S)).copy()
+                self.icons[(generation.gen*C+missing[i], size)] = icon
+                self.bytes += icon.get_width()*icon.get_height()*icon.get_bytesize()
+        icons = []
+        for key in keys:
+            self.icons.move_to_end(key)
+            icons.append(self.icons[key])
+        while self.bytes > self.maxBytes and len(self.icons) > len(keys):
+            _, old = self.icons.popitem(last=False)
+            self.bytes -= old.get_width()*old.get_height()*old.get_bytesize()
+        return icons
+
+    def clear(self):
+        # e.g. after a species is recolored, since every icon shows its species' color
+        self.icons.clear()
+        self.bytes = 0
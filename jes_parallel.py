@@ -0,0 +1,75 @@
+import multiprocessing
+import signal
+import numpy as np
+from jes_trajectory import TrajectoryRecorder
+
+# Sharded evaluation of a generation: the population (or just the rows asked for) is
+# split into one contiguous slice per worker process, every worker simulates its slice,
+# and the slices are glued back together in order. Creatures never interact, so the result is exactly
+# what the serial path would have produced.
+#
+# Scripts that turn this on (Sim(..., _workers=N) with N > 1) must guard their
+# main code with  if __name__ == "__main__":  because on Windows every worker
+# process re-imports the main script.
+
+_physics = None # this worker's copy of the Sim settings (see Sim.getPhysicsCopy)
+
+def _initWorker(physics, progress):
+    global _physics
+    _physics = physics
+    _physics.progress = progress
+    # Forked after pygame started, a worker inherits SDL's SIGTERM handler, which would
+    # turn Pool.terminate() into an event nobody reads. Make SIGTERM kill it again.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def _simulateShard(job):
+    nodeCoor, muscles, frameCount, calmingRun, stride, slot, run = job
+    if _physics.progress is not None:
+        _physics.progress.startJob(slot, run)
+    recorder = None
+    if stride > 0:
+        recorder = TrajectoryRecorder(len(nodeCoor), frameCount, stride, nodeCoor.shape)
+    nodeCoor, _, _ = _physics.simulateRun((nodeCoor, muscles, 0), frameCount, calmingRun, recorder)
+    return nodeCoor, (None if recorder is None else recorder.frames)
+
+class ShardPool:
+    def __init__(self, sim, workers, progress=None):
+        # progress, if given, is a SimProgress the workers count their frames in (see jes_sim_worker.py)
+        self.sim = sim
+        self.workers = workers
+        self.progress = progress
+        self.pool = multiprocessing.Pool(workers, initializer=_initWorker, initargs=(sim.getPhysicsCopy(), progress))
+
+    def simulate(self, gen, startIndex, endIndex, fromCalmState, frameCount, calmingRun, recorder=None, rows=None):
+        return self.simulateAsync(gen, startIndex, endIndex, fromCalmState, frameCount, calmingRun, recorder, rows)()
+        
+    def simulateAsync(self, gen, startIndex, endIndex, fromCalmState, frameCount, calmingRun, recorder=None, rows=None):
+        # Hands the shards to the workers and returns right away, with a function that waits for their results
+        if rows is None:
+            rows = np.arange(startIndex, endIndex)
+        stride = 0 if recorder is None else recorder.stride
+        jobs = []
+        for shard in np.array_split(rows, self.workers):
+            if len(shard) >= 1:
+                nodeCoor, muscles, _ = self.sim.simulateImport(gen, shard[0], shard[-1]+1, fromCalmState, shard)
+                jobs.append([nodeCoor, muscles, frameCount, calmingRun, stride, len(jobs), None])
+        if self.progress is not None:
+            run = self.progress.begin(calmingRun, frameCount*len(jobs))
+            for job in jobs:
+                job[-1] = run
+        pending = self.pool.map_async(_simulateShard, jobs)
+        def collect():
+            results = pending.get()
+            if recorder is not None:
+                recorder.frames[:] = np.concatenate([frames for _, frames in results], axis=1)
+            return np.concatenate([nodeCoor for nodeCoor, _ in results], axis=0)
+        return collect
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        # stops the workers without waiting for what they're doing
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,143 @@
+import csv
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+class Profiler:
+    # Per-phase timing of each generation (see Sim.doGeneration), turned on with sim.profiler = Profiler().
+    # Phases nest (e.g. "import" happens inside "trial" and "calming"), and each phase only gets
+    # the time not spent in the phases inside it, so a generation's phases add up to its total.
+    # With trackAllocations, tracemalloc also records how many bytes each phase allocated
+    # (NumPy arrays included), though that slows everything down quite a bit.
+    # If logPath ends in .csv or .jsonl, every finished generation gets appended to it.
+    # With a SimWorker, generations run on its thread while the UI thread draws them afterwards:
+    # the UI wraps that in addingTo(gen), so "graphs" and "icons" still end up in gen's record
+    # (though not in its total_s, since they overlap the next generation's work).
+    PHASES = ["import","trial","ranking","species","reproduction","graphs","calming","icons","checkpoint"]
+
+    def __init__(self, trackAllocations=False, logPath=None):
+        self.trackAllocations = trackAllocations
+        self.logPath = logPath
+        self.records = [] # one per finished generation
+        self.current = None
+        self.generationStart = None
+        self.thread = None # the thread running the generation (see jes_sim_worker.py)
+        self.local = threading.local() # per thread: stack of [name, start time, time in nested phases, allocated bytes at start],
+        # and the finished record that phases on another thread are added to (see addingTo)
+        if trackAllocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def startGeneration(self, gen):
+        self.current = {"gen": gen, "total_s": 0.0, "creature_frames": 0, "creatures": 0,
+        "time_s": {name: 0.0 for name in self.PHASES}}
+        if self.trackAllocations:
+            self.current["alloc_bytes"] = {name: 0 for name in self.PHASES}
+        self.generationStart = time.perf_counter()
+        self.thread = threading.get_ident()
+
+    def endGeneration(self, log=True):
+        # log=False leaves logging the record to addingTo, once the UI has added its phases
+        record = self.current
+        record["total_s"] = time.perf_counter()-self.generationStart
+        simulating = record["time_s"]["trial"]+record["time_s"]["calming"]+record["time_s"]["import"]
+        record["creature_frames_per_s"] = record["creature_frames"]/simulating if simulating > 0 else 0.0
+        record["creatures_per_s"] = record["creatures"]/record["total_s"] if record["total_s"] > 0 else 0.0
+        self.records.append(record)
+        self.current = None
+        if log and self.logPath is not None:
+            self.appendToLog(record)
+        return record
+
+    @contextmanager
+    def addingTo(self, gen):
+        # Phases on this thread count towards gen's finished record, which is logged afterwards
+        record = next((r for r in reversed(self.records) if r["gen"] == gen), None)
+        self.local.record = record
+        try:
+            yield
+        finally:
+            self.local.record = None
+            if record is not None and self.logPath is not None:
+                self.appendToLog(record)
+
+    def getStack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def phase(self, name):
+        if self.current is not None and threading.get_ident() == self.thread:
+            record = self.current
+        else:
+            record = getattr(self.local, "record", None)
+        if record is None: # only generations are profiled
+            yield
+            return
+        stack = self.getStack()
+        allocated = tracemalloc.get_traced_memory()[0] if self.trackAllocations else 0
+        stack.append([name, time.perf_counter(), 0.0, allocated])
+        try:
+            yield
+        finally:
+            _, start, nested, allocated = stack.pop()
+            elapsed = time.perf_counter()-start
+            record["time_s"][name] = record["time_s"].get(name,0.0)+elapsed-nested
+            if stack:
+                stack[-1][2] += elapsed
+            if self.trackAllocations and "alloc_bytes" in record:
+                # net bytes still allocated at the end of the phase
+                alloc = record["alloc_bytes"]
+                alloc[name] = alloc.get(name,0)+tracemalloc.get_traced_memory()[0]-allocated
+
+    def count(self, creatures, frames):
+        # creatures simulated for that many frames each
+        if self.current is not None and threading.get_ident() == self.thread:
+            self.current["creatures"] = max(self.current["creatures"], creatures)
+            self.current["creature_frames"] += creatures*frames
+
+    def getLast(self):
+        return self.records[-1] if self.records else None
+
+    def getSummary(self):
+        # mean time per phase over every recorded generation
+        if not self.records:
+            return {}
+        names = self.records[-1]["time_s"].keys()
+        return {name: sum(r["time_s"].get(name,0.0) for r in self.records)/len(self.records) for name in names}
+
+    def getRow(self, record):
+        # a record flattened into one CSV row
+        row = {"gen": record["gen"], "total_s": record["total_s"]}
+        for name, t in record["time_s"].items():
+            row[name+"_s"] = t
+        for name, b in record.get("alloc_bytes", {}).items():
+            row[name+"_bytes"] = b
+        row["creature_frames_per_s"] = record["creature_frames_per_s"]
+        row["creatures_per_s"] = record["creatures_per_s"]
+        return row
+
+    def appendToLog(self, record):
+        if self.logPath.endswith(".csv"):
+            row = self.getRow(record)
+            with open(self.logPath, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(row.keys()))
+                if f.tell() == 0:
+                    writer.writeheader()
+                writer.writerow(row)
+        else:
+            with open(self.logPath, "a") as f:
+                f.write(json.dumps(record)+"\n")
+
+    def writeCSV(self, path):
+        rows = [self.getRow(r) for r in self.records]
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ["gen"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def writeJSON(self, path):
+        with open(path, "w") as f:
+            json.dump({"records": self.records, "summary": self.getSummary()}, f, indent=1)
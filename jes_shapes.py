@@ -1,4 +1,7 @@
-import pygame
+try:
+    import pygame
+except ImportError: # headless runs (jes_headless.py) never draw, so they don't need pygame
+    pygame = None
 import math
 import copy
 from utils import lerp, speciesToColor, species_to_name
@@ -123,7 +126,7 @@ def drawSpeciesCircle(screen, s, coor, R, sim, species_info, font, shouldDrawArr
     centerText(screen, name, cx, cy-22, (0,0,0), font)
         
     creature = sim.getCreatureWithID(info.reps[2])
-    tiny_icon = pygame.transform.scale(creature.icons[0], (50,50))
+    tiny_icon = pygame.transform.scale(ui.iconCache.getIcon(creature, 0), (50,50))
     screen.blit(tiny_icon,(cx-25,cy-11))
     
     if shouldDrawArrow:
@@ -1,17 +1,29 @@
 import numpy as np
-from utils import getDistanceArray, applyMuscles
-from jes_creature import Creature
+from jes_workspace import Workspace
+from jes_generation import Generation
 from jes_species_info import SpeciesInfo
-from jes_dataviz import drawAllGraphs
+from jes_species_pops import SpeciesPops
 import time
-import random
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from jes_trajectory import TrajectoryRecorder, TrajectoryStore
+from jes_history import History
+from jes_checkpoint import Checkpoint
+from jes_growable import GrowableArray
 
 class Sim:
     def __init__(self, _c_count, _stabilization_time, _trial_time, _beat_time,
     _beat_fade_time, _c_dim, _beats_per_cycle, _node_coor_count,
     _y_clips, _ground_friction_coef, _gravity_acceleration_coef,
     _calming_friction_coef, _typical_friction_coef, _muscle_coef,
-    _traits_per_box, _traits_extra, _mutation_rate, _big_mutation_rate, _UNITS_PER_METER):
+    _traits_per_box, _traits_extra, _mutation_rate, _big_mutation_rate, _UNITS_PER_METER, _float_type=np.float64, _workers=1,
+    _trajectory_stride=0, _trajectory_memory=64*1024*1024, _hot_generations=None, _history_dir=None, _checkpoint_dir=None,
+    _percentile_resolution=100, _seed=None, _memoize_fitness=False, _memoize_check=0.0):
+        if _c_count < 2 or _c_count%2 != 0: # getParents pairs the k-th best with the k-th worst, so nobody can be left over
+            raise ValueError(f"The number of creatures must be even and at least 2, not {_c_count}")
         self.c_count = _c_count #creature count
         self.species_count = _c_count #species count
         self.stabilization_time = _stabilization_time
@@ -28,6 +40,7 @@ class Sim:
         self.calming_friction_coef = _calming_friction_coef
         self.typical_friction_coef = _typical_friction_coef
         self.muscle_coef = _muscle_coef
+        self.float_type = np.dtype(_float_type) # np.float32 halves the memory traffic of the physics, at some cost in precision
         
         self.traits_per_box = _traits_per_box
         self.traits_extra = _traits_extra
@@ -38,74 +51,189 @@ class Sim:
         
         self.S_VISIBLE = 0.05 #what proportion of the population does a species need to appear on the SAC graph?
         self.S_NOTABLE = 0.10 #what proportion of the population does a species need to appear in the genealogy?
-        self.HUNDRED = 100 # change this if you want to change the resolution of the percentile-tracking
+        self.HUNDRED = _percentile_resolution # how finely percentiles are tracked (100: every percent, 1000: every per-mille)
         self.UNITS_PER_METER = _UNITS_PER_METER
-        self.creatures = None
-        self.rankings = np.zeros((0,self.c_count), dtype=int)
-        self.percentiles = np.zeros((0,self.HUNDRED+1))
-        self.species_pops = []
+        self.creatures = None # one Generation per generation (see jes_generation.py and jes_history.py)
+        self.hot_generations = _hot_generations # how many of the newest generations stay in RAM (None: all of them)
+        self.history_dir = _history_dir # where older generations are spilled to (None: a temporary directory)
+        self.checkpoint = None # saves the run after every generation, so it can be resumed (see jes_checkpoint.py)
+        if _checkpoint_dir is not None:
+            self.checkpoint = Checkpoint(self, _checkpoint_dir)
+            self.history_dir = _checkpoint_dir # the checkpoint's generation files double as the spill files
+        self.rankings = GrowableArray((self.c_count,), int) # one row per finished generation (see jes_growable.py)
+        self.percentiles = GrowableArray((self.HUNDRED+1,), float)
+        self.species_pops = GrowableArray((), object)
         self.species_info = []
         self.prominent_species = []
         self.ui = None
         self.last_gen_run_time = -1
+        self.workspaces = OrderedDict() # preallocated simulateRun buffers, one per population size (see jes_workspace.py), least recently used first
+        self.workers = _workers # more than 1 shards each generation across a process pool (see jes_parallel.py)
+        self.pool = None
+        self.trajectories = None # recorded trials of the creatures worth replaying (see jes_trajectory.py)
+        self.profiler = None # set to a Profiler to time each phase of every generation (see jes_profiler.py)
+        if _seed is None: # drawn from np.random, so seeding that (see jes_headless.seedEverything) still makes runs reproducible
+            _seed = np.random.randint(0, 2**31)
+        self.rng = np.random.default_rng(_seed) # every random choice of selection and reproduction
+        self.calm_cache = {} # (frameCount, genome hash) -> calm state, for the last generation calmed (see getCalmStates)
+        self.memoize_fitness = _memoize_fitness # reuse the trial result of an identical genome and calm state (see getTrialScores)
+        self.memoize_check = _memoize_check # what fraction of those reused results to re-simulate, to check they really match
+        self.fitness_cache = {} # (genome and calm state hash) -> (fitness, ID of the creature actually simulated), for the last generation tested
+        self.lock = threading.RLock() # held while anything changes the Sim's state
+        self.worker = None # set to a SimWorker to run ALAP generations in the background (see jes_sim_worker.py)
+        self.progress = None # counts the frames simulated, in the processes a SimWorker's physics runs in
+        if _trajectory_stride > 0:
+            self.trajectories = TrajectoryStore(_trajectory_stride, _trajectory_memory)
         
     def initializeUniverse(self):
-        self.creatures = [[None]*self.c_count]
+        dna = np.clip(np.random.normal(0.0, 1.0, (self.c_count,self.trait_count)),-3,3)
+        self.creatures = History(self, self.hot_generations, self.history_dir)
+        self.creatures.append(Generation(self, 0, dna, np.arange(self.c_count))) # every creature starts out as its own species
         for c in range(self.c_count):
-            self.creatures[0][c] = self.createNewCreature(c)
             self.species_info.append(SpeciesInfo(self,self.creatures[0][c], None))
             
         # We want to make sure that all creatures, even in their
         # initial state, are in calm equilibrium. They shouldn't
         # be holding onto potential energy (e.g. compressed springs)
         self.getCalmStates(0,0,self.c_count,self.stabilization_time,True) #Calm the creatures down so no potential energy is stored
+        if self.checkpoint is not None:
+            self.checkpoint.save()
         
-        for c in range(self.c_count):
-            for i in range(2):
-                self.creatures[0][c].icons[i] = self.creatures[0][c].drawIcon(self.ui.ICON_DIM[i], self.ui.MOSAIC_COLOR, self.beat_fade_time)
-            
-        self.ui.drawCreatureMosaic(0)
-        
-    def createNewCreature(self, idNumber):
-        dna = np.clip(np.random.normal(0.0, 1.0, self.trait_count),-3,3)
-        return Creature(dna, idNumber, -1, self, self.ui)
+        if self.ui is None: # headless runs (see jes_headless.py) skip all rendering
+            return
+        self.ui.drawCreatureMosaic(0) # icons are drawn on demand (see jes_icon_cache.py)
         
     def getCalmStates(self, gen, startIndex, endIndex, frameCount, calmingRun):
-        param = self.simulateImport(gen, startIndex, endIndex, False)
-        nodeCoor, muscles, _ = self.simulateRun(param, frameCount, True)
-        for c in range(self.c_count):
-            self.creatures[gen][c].saveCalmState(nodeCoor[c])
+        self.startCalmStates(gen, startIndex, endIndex, frameCount)()
+        
+    def startCalmStates(self, gen, startIndex, endIndex, frameCount):
+        # Calming starts every creature from the same grid, so a calm state only depends on the DNA.
+        # Genomes the last calmed generation already had (clones, mostly) reuse its calm state,
+        # and only the new ones get simulated.
+        # With worker processes, this returns once they've started on it, and calling the
+        # function it returns waits for them and saves the calm states.
+        generation = self.creatures[gen]
+        keys = [(frameCount, key) for key in self.getGenomeKeys(generation.dna[startIndex:endIndex])]
+        cached = np.array([key in self.calm_cache for key in keys], dtype=bool)
+        for i in np.flatnonzero(cached):
+            generation.calmStates[startIndex+i] = self.calm_cache[keys[i]]
+        rows = startIndex+np.flatnonzero(~cached)
+        collect = None
+        if len(rows) >= 1:
+            collect = self.startSimulatingPopulation(gen, startIndex, endIndex, False, frameCount, True, rows=rows)
+        def finish():
+            if collect is not None:
+                generation.calmStates[rows] = collect()
+            generation.calmed = True
+            self.calm_cache = {key: generation.calmStates[startIndex+i] for i, key in enumerate(keys)}
+        return finish
+        
+    def getGenomeKeys(self, dna, calmStates=None):
+        # a hash of each DNA row (and calm state, if given), so identical genomes can be recognized
+        dna = np.ascontiguousarray(dna)
+        if calmStates is None:
+            return [hashlib.blake2b(row, digest_size=16).digest() for row in dna]
+        calmStates = np.ascontiguousarray(calmStates)
+        keys = []
+        for c in range(len(dna)):
+            h = hashlib.blake2b(dna[c], digest_size=16)
+            h.update(calmStates[c])
+            keys.append(h.digest())
+        return keys
             
-    def getStartingNodeCoor(self, gen, startIndex, endIndex, fromCalmState):
-        COUNT = endIndex-startIndex
-        n = np.zeros((COUNT,self.CH+1,self.CW+1,self.node_coor_count))
-        if not fromCalmState or self.creatures[gen][0].calmState is None:
+    def getStartingNodeCoor(self, gen, startIndex, endIndex, fromCalmState, rows=None):
+        # rows, if given, picks the creatures instead of startIndex..endIndex
+        if rows is None:
+            rows = slice(startIndex, endIndex)
+        COUNT = len(self.creatures[gen].species[rows])
+        n = np.zeros((COUNT,self.CW+1,self.CH+1,self.node_coor_count), dtype=self.float_type) # x-major, like the DNA
+        if not fromCalmState or not self.creatures[gen].calmed:
             # create grid of nodes along perfect gridlines
             coorGrid = np.mgrid[0:self.CW+1,0:self.CH+1]
             coorGrid = np.swapaxes(np.swapaxes(coorGrid,0,1),1,2)
             n[:,:,:,0:2] = coorGrid
         else:
             # load calm state into nodeCoor
-            for c in range(startIndex,endIndex):
-                n[c-startIndex,:,:,:] = self.creatures[gen][c].calmState
-                n[c-startIndex,:,:,1] -= self.CH  # lift the creature above ground level
+            n[:] = self.creatures[gen].calmStates[rows]
+            n[:,:,:,1] -= self.CH  # lift the creatures above ground level
         return n
 
-    def getMuscleArray(self, gen, startIndex, endIndex):
-        COUNT = endIndex-startIndex
-        m = np.zeros((COUNT,self.CH,self.CW,self.beats_per_cycle,self.traits_per_box+1)) # add one trait for diagonal length.
-        DNA_LEN = self.CH*self.CW*self.beats_per_cycle*self.traits_per_box
-        for c in range(startIndex,endIndex):
-            dna = self.creatures[gen][c].dna[0:DNA_LEN].reshape(self.CH,self.CW,self.beats_per_cycle,self.traits_per_box)
-            m[c-startIndex,:,:,:,:self.traits_per_box] = 1.0+(dna)/3.0
+    def getMuscleArray(self, gen, startIndex, endIndex, rows=None):
+        if rows is None:
+            rows = slice(startIndex, endIndex)
+        dna = self.creatures[gen].dna[rows]
+        COUNT = len(dna)
+        m = np.zeros((COUNT,self.CW,self.CH,self.beats_per_cycle,self.traits_per_box+1), dtype=self.float_type) # add one trait for diagonal length.
+        DNA_LEN = self.CW*self.CH*self.beats_per_cycle*self.traits_per_box
+        dna = dna[:,0:DNA_LEN].reshape(COUNT,self.CW,self.CH,self.beats_per_cycle,self.traits_per_box) # cell (x,y) is at x*CH+y, see Creature.traitsToColor
+        m[:,:,:,:,:self.traits_per_box] = 1.0+(dna)/3.0
         m[:,:,:,:,3] = np.sqrt(np.square(m[:,:,:,:,0])+np.square(m[:,:,:,:,1])) # Set diagonal tendons
         return m
 
-    def simulateImport(self, gen, startIndex, endIndex, fromCalmState):
-        nodeCoor = self.getStartingNodeCoor(gen,startIndex,endIndex,fromCalmState)
-        muscles = self.getMuscleArray(gen,startIndex,endIndex)
+    def simulateImport(self, gen, startIndex, endIndex, fromCalmState, rows=None):
+        with self.phase("import"):
+            nodeCoor = self.getStartingNodeCoor(gen,startIndex,endIndex,fromCalmState,rows)
+            muscles = self.getMuscleArray(gen,startIndex,endIndex,rows)
         currentFrame = 0
         return nodeCoor, muscles, currentFrame
+        
+    def phase(self, name):
+        # times whatever happens inside  with sim.phase(name):  if profiling is on
+        return nullcontext() if self.profiler is None else self.profiler.phase(name)
+
+    def simulatePopulation(self, gen, startIndex, endIndex, fromCalmState, frameCount, calmingRun, recorder=None, rows=None):
+        # Runs creatures startIndex..endIndex (or just the given rows) of a generation for frameCount frames, and returns their final nodeCoor.
+        return self.startSimulatingPopulation(gen, startIndex, endIndex, fromCalmState, frameCount, calmingRun, recorder, rows)()
+        
+    def startSimulatingPopulation(self, gen, startIndex, endIndex, fromCalmState, frameCount, calmingRun, recorder=None, rows=None):
+        # Like simulatePopulation, but returns a function that returns the final nodeCoor. With worker
+        # processes, it returns as soon as they have the creatures, so other work can happen meanwhile.
+        if self.profiler is not None:
+            self.profiler.count(endIndex-startIndex if rows is None else len(rows), frameCount)
+        if self.workers > 1 or self.worker is not None: # a SimWorker always leaves the physics to another process
+            if self.pool is None:
+                from jes_parallel import ShardPool
+                self.pool = ShardPool(self, self.workers, None if self.worker is None else self.worker.progress)
+            collect = self.pool.simulateAsync(gen, startIndex, endIndex, fromCalmState, frameCount, calmingRun, recorder, rows)
+            def finish():
+                with self.unlocked():
+                    return collect()
+            return finish
+        param = self.simulateImport(gen, startIndex, endIndex, fromCalmState, rows)
+        with self.unlocked():
+            nodeCoor, _, _ = self.simulateRun(param, frameCount, calmingRun, recorder)
+        return lambda: nodeCoor
+        
+    def uiLock(self):
+        # what the UI thread holds while it draws a frame (see jes.py)
+        return self.lock if self.worker is None else self.worker.uiLock()
+        
+    def unlocked(self):
+        # simulating only reads what was imported, so a SimWorker lets go of self.lock meanwhile
+        return nullcontext() if self.worker is None else self.worker.unlocked()
+
+    def getPhysicsCopy(self):
+        # A copy of the Sim with only its settings, light enough to send to worker processes.
+        physics = copy.copy(self)
+        physics.creatures = None
+        physics.rankings = None
+        physics.percentiles = None
+        physics.species_pops = []
+        physics.species_info = []
+        physics.prominent_species = []
+        physics.ui = None
+        physics.workspaces = OrderedDict()
+        physics.workers = 1
+        physics.pool = None
+        physics.trajectories = None
+        physics.checkpoint = None
+        physics.profiler = None
+        physics.calm_cache = {}
+        physics.fitness_cache = {}
+        physics.lock = None
+        physics.worker = None
+        physics.progress = None
+        return physics
 
     def frameToBeat(self, f):
         return (f//self.beat_time)%self.beats_per_cycle
@@ -114,12 +242,27 @@ class Sim:
         prog = f%self.beat_time
         return min(prog/self.beat_fade_time,1)
 
-    def simulateRun(self, param, frameCount, calmingRun):
+    def getWorkspace(self, nodeCoor):
+        key = (nodeCoor.shape, nodeCoor.dtype, threading.get_ident()) # threads never share buffers
+        if key in self.workspaces:
+            self.workspaces.move_to_end(key)
+        else:
+            if len(self.workspaces) >= 4: # batches of only some rows come in all sizes, so drop the least recently used
+                self.workspaces.popitem(last=False)
+            self.workspaces[key] = Workspace(nodeCoor.shape, self.beats_per_cycle, nodeCoor.dtype)
+        return self.workspaces[key]
+
+    def simulateRun(self, param, frameCount, calmingRun, recorder=None):
         nodeCoor, muscles, startCurrentFrame = param
         friction = self.calming_friction_coef if calmingRun else self.typical_friction_coef
         CEILING_Y = self.y_clips[0]
         FLOOR_Y = self.y_clips[1]
-        
+        ws = self.getWorkspace(nodeCoor)
+        ws.loadMuscles(muscles)
+        position = nodeCoor[:,:,:,0:2]
+        velocity = nodeCoor[:,:,:,2:4]
+        if recorder is not None:
+            recorder.record(0, nodeCoor)
         for f in range(frameCount):
             currentFrame = startCurrentFrame+f
             beat = 0
@@ -128,122 +271,260 @@ class Sim:
                 beat = self.frameToBeat(currentFrame)
                 nodeCoor[:,:,:,3] += self.gravity_acceleration_coef
                 # decrease y-velo (3rd node coor) by G
-            applyMuscles(nodeCoor,muscles[:,:,:,beat,:],self.muscle_coef)
-            nodeCoor[:,:,:,2:4] *= friction
-            nodeCoor[:,:,:,0:2] += nodeCoor[:,:,:,2:4]    # all node's x and y coordinates are adjusted by velocity_x and velocity_y
+            ws.applyMuscles(nodeCoor,beat,self.muscle_coef)
+            velocity *= friction
+            position += velocity    # all node's x and y coordinates are adjusted by velocity_x and velocity_y
             
             if not calmingRun:    # dealing with collision with the ground.
-                nodesTouchingGround = np.ma.masked_where(nodeCoor[:,:,:,1] >= FLOOR_Y, nodeCoor[:,:,:,1])
-                m = nodesTouchingGround.mask.astype(float) # mask that only countains 1's where nodes touch the floor
-                pressure = nodeCoor[:,:,:,1]-FLOOR_Y
-                groundFrictionMultiplier = 0.5**(m*pressure*self.ground_friction_coef)
-                
-                nodeCoor[:,:,:,1] = np.clip(nodeCoor[:,:,:,1], CEILING_Y, FLOOR_Y) # clip nodes below the ground back to ground level
-                nodeCoor[:,:,:,2] *= groundFrictionMultiplier # any nodes touching the ground must be slowed down by ground friction.
+                ws.applyGround(nodeCoor,FLOOR_Y,CEILING_Y,self.ground_friction_coef)
+            if recorder is not None:
+                recorder.record(f+1, nodeCoor)
+            if self.progress is not None:
+                self.progress.onFrame(calmingRun)
         
         if calmingRun: # If it's a calming run, then take the average location of all nodes to center it at the origin.
             nodeCoor[:,:,:,0] -= np.mean(nodeCoor[:,:,:,0], axis=(1,2), keepdims=True)
         return nodeCoor, muscles, startCurrentFrame+frameCount  
         
-    def doSpeciesInfo(self,nsp,best_of_each_species):
-        nsp = dict(sorted(nsp.items()))
-        running = 0
-        for sp in nsp.keys():
-            pop = nsp[sp][0]
-            nsp[sp][1] = running
-            nsp[sp][2] = running+pop
-            running += pop
+    def doSpeciesInfo(self, species, counts, best):
+        # Returns this generation's SpeciesPops (see jes_species_pops.py), after updating each species' info,
+        # and the species that just got prominent. They're left for the caller to promote (see runGeneration).
+        # species is sorted, and best[i] is the ID of the best creature of species[i].
+        pops = SpeciesPops(species, counts)
+        notable = []
+        for i in range(len(pops)):
+            sp = pops.species[i]
+            pop = pops.pops[i]
             
             info = self.species_info[sp]
-            info.reps[3] = best_of_each_species[sp] # most-recent representative
+            info.reps[3] = best[i] # most-recent representative
             if pop > info.apex_pop: # This species reached its highest population
                 info.apex_pop = pop
-                info.reps[2] = best_of_each_species[sp] # apex representative
+                info.reps[2] = best[i] # apex representative
             if pop >= self.c_count*self.S_NOTABLE and not info.prominent:  #prominent threshold
-                info.becomeProminent()
+                notable.append(info)
+        return pops, notable
                 
     def checkALAP(self):
-        if self.ui.ALAPButton.setting == 1: # We're already ALAP-ing!
-            self.doGeneration(self.ui.doGenButton)
+        if self.worker is None:
+            if self.ui.ALAPButton.setting == 1: # We're already ALAP-ing!
+                self.doGeneration(self.ui.doGenButton)
+            return
+        if self.ui.ALAPButton.setting == 1 and self.worker.requested == 0:
+            self.worker.start()
+        elif self.ui.ALAPButton.setting == 0 and self.worker.requested < 0:
+            self.worker.pause()
+        for gen in self.worker.getFinished():
+            # drawn here on the UI thread, but still profiled as part of gen
+            with nullcontext() if self.profiler is None else self.profiler.addingTo(gen):
+                self.showGeneration(gen)
         
     def doGeneration(self, button):
         generation_start_time = time.time() #calculates how long each generation takes to run
-        
+        if self.profiler is not None:
+            self.profiler.startGeneration(len(self.creatures)-1)
+        gen = self.runGeneration()
+        if self.ui is not None:
+            self.showGeneration(gen)
+            self.last_gen_run_time = time.time()-generation_start_time
+        if self.profiler is not None:
+            self.profiler.endGeneration()
+            
+    def runGeneration(self):
+        # Tests the newest generation, and breeds and calms the next one. Returns the tested generation's number.
+        # Nothing here touches the UI, so a background worker can run it (see jes_sim_worker.py).
+        generation_start_time = time.time()
         gen = len(self.creatures)-1
-        creatureState = self.simulateImport(gen, 0, self.c_count, True)
-        nodeCoor, muscles, _ = self.simulateRun(creatureState, self.trial_time, False)
-        finalScores = nodeCoor[:,:,:,0].mean(axis=(1, 2)) # find each creature's average X-coordinate
+        with self.phase("trial"):
+            recorder = None
+            if self.trajectories is not None:
+                recorder = TrajectoryRecorder(self.c_count, self.trial_time, self.trajectories.stride, self.creatures[gen].calmStates.shape)
+            finalScores, sources = self.getTrialScores(gen, recorder)
         
         # Tallying up all the data
-        currRankings = np.flip(np.argsort(finalScores),axis=0)
-        newPercentiles = np.zeros((self.HUNDRED+1))
-        newSpeciesPops = {}
-        best_of_each_species = {}
-        for rank in range(self.c_count):
-            c = currRankings[rank]
-            self.creatures[gen][c].fitness = finalScores[c]
-            self.creatures[gen][c].rank = rank
-            
-            species = self.creatures[gen][c].species
-            if species in newSpeciesPops:
-                newSpeciesPops[species][0] += 1
-            else:
-                newSpeciesPops[species] = [1,None,None]
-            if species not in best_of_each_species:
-                best_of_each_species[species] = self.creatures[gen][c].IDNumber
-        self.doSpeciesInfo(newSpeciesPops,best_of_each_species)
-
-        for p in range(self.HUNDRED+1):
-            rank = min(int(self.c_count*p/self.HUNDRED),self.c_count-1)
-            c = currRankings[rank]
-            newPercentiles[p] = self.creatures[gen][c].fitness
-        
-        currCreatures = self.creatures[-1]
-        nextCreatures = [None]*self.c_count
-        for rank in range(self.c_count//2):
-            winner = currRankings[rank]
-            loser = currRankings[(self.c_count-1)-rank]
-            if random.uniform(0,1) < rank/self.c_count:
-                ph = loser
-                loser = winner
-                winner = ph
-            nextCreatures[winner] = None
-            if random.uniform(0,1) < rank/self.c_count*2.0:  # A 1st place finisher is guaranteed to make a clone, but as we get closer to the middle the odds get more likely we just get 2 mutants.
-                nextCreatures[winner] = self.mutate(self.creatures[gen][winner],(gen+1)*self.c_count+winner)
-            else:
-                nextCreatures[winner] = self.clone(self.creatures[gen][winner],(gen+1)*self.c_count+winner)
-            nextCreatures[loser] = self.mutate(self.creatures[gen][winner],(gen+1)*self.c_count+loser)
-            self.creatures[gen][loser].living = False
-        
-        self.creatures.append(nextCreatures)
-        self.rankings = np.append(self.rankings,currRankings.reshape((1,self.c_count)),axis=0)
-        self.percentiles = np.append(self.percentiles,newPercentiles.reshape((1,self.HUNDRED+1)),axis=0)
-        self.species_pops.append(newSpeciesPops)
+        with self.phase("ranking"):
+            currRankings = np.flip(np.argsort(finalScores),axis=0)
+            current = self.creatures[gen]
+            current.saveResults(finalScores, currRankings)
+            percentileRanks = np.minimum(self.c_count*np.arange(self.HUNDRED+1)//self.HUNDRED, self.c_count-1)
+            newPercentiles = np.take(current.fitness, np.take(currRankings, percentileRanks))
         
-        drawAllGraphs(self, self.ui)
+        with self.phase("reproduction"):
+            parents, mutants = self.getParents(currRankings)
+            current.living[parents != np.arange(self.c_count)] = False
+            dna, childSpecies, codonWithChange = self.getMutatedGenomes(gen, parents, mutants)
+            child = Generation(self, gen+1, dna, childSpecies)
+            child.codonWithChange[:] = codonWithChange
+            self.creatures.append(child)
         
-        self.getCalmStates(gen+1,0,self.c_count,self.stabilization_time,True)
-        #Calm the creatures down so no potential energy is stored
-        for c in range(self.c_count):
-            for i in range(2):
-                self.creatures[gen+1][c].icons[i] = self.creatures[gen+1][c].drawIcon(self.ui.ICON_DIM[i], self.ui.MOSAIC_COLOR, self.beat_fade_time)
-  
-        self.ui.genSlider.val_max = gen+1
-        self.ui.genSlider.manualUpdate(gen)
+        with self.phase("calming"):
+            # Calm the creatures down so no potential energy is stored. With worker processes,
+            # they do it while the rest of the bookkeeping happens here (none of it needs calm states).
+            finishCalming = self.startCalmStates(gen+1,0,self.c_count,self.stabilization_time)
+        
+        with self.phase("species"):
+            # np.unique finds each species' first (so best) rank along with its population
+            species, bestRanks, counts = np.unique(np.take(current.species, currRankings), return_index=True, return_counts=True)
+            best = gen*self.c_count+np.take(currRankings, bestRanks) # IDs of each species' best creature
+            newSpeciesPops, notable = self.doSpeciesInfo(species, counts, best)
+            for c in np.flatnonzero(codonWithChange >= 0): # big mutations start new species
+                self.species_info.append(SpeciesInfo(self,child[c],current[parents[c]]))
+        with self.phase("trial"):
+            if recorder is not None:
+                self.keepTrajectories(gen, recorder, currRankings, best, parents, sources)
+        self.rankings.append(currRankings)
+        self.percentiles.append(newPercentiles)
+        self.species_pops.append(newSpeciesPops)
+        
+        with self.phase("calming"):
+            finishCalming()
+        # Only now, since a SimWorker lets the UI draw while calming: the genealogy graph
+        # can't show a prominent species until showGeneration has laid it out.
+        for info in notable:
+            if not info.prominent: # it may have been promoted as another's ancestor already
+                info.becomeProminent()
+        if self.checkpoint is not None:
+            with self.phase("checkpoint"):
+                self.checkpoint.save()
         self.last_gen_run_time = time.time()-generation_start_time
+        return gen
         
+    def showGeneration(self, gen):
+        # The UI's side of a finished generation: its graphs, and moving the slider to it.
+        with self.phase("graphs"):
+            from jes_dataviz import drawAllGraphs # imported here so headless runs never need pygame
+            drawAllGraphs(self, self.ui)
+        self.ui.genSlider.val_max = gen+1
+        self.ui.genSlider.manualUpdate(gen) # redraws the mosaic, and with it the new icons
         self.ui.detectMouseMotion()
         
+    def getTrialScores(self, gen, recorder):
+        # Each creature's fitness: its average X-coordinate at the end of the trial.
+        # The trial only depends on the DNA and the calm state, so with memoize_fitness on, a creature
+        # identical to one of the last generation tested (a clone, mostly) just reuses its fitness.
+        # Also returns, for each creature, the ID of the creature whose trial it reused (-1 if none).
+        C = self.c_count
+        sources = np.full(C, -1, dtype=int)
+        if not self.memoize_fitness:
+            nodeCoor = self.simulatePopulation(gen, 0, C, True, self.trial_time, False, recorder)
+            return nodeCoor[:,:,:,0].mean(axis=(1, 2)), sources
+        current = self.creatures[gen]
+        keys = self.getGenomeKeys(current.dna, current.calmStates)
+        finalScores = np.zeros(C)
+        for c in range(C):
+            if keys[c] in self.fitness_cache:
+                finalScores[c], sources[c] = self.fitness_cache[keys[c]]
+        rows = np.flatnonzero(sources < 0)
+        if len(rows) >= 1:
+            finalScores[rows] = self.getRowScores(gen, rows, recorder)
+        
+        hits = np.flatnonzero(sources >= 0)
+        checks = hits[np.random.default_rng(gen).random(len(hits)) < self.memoize_check] # not sim.rng, so checking never changes the run
+        if len(checks) >= 1:
+            checkScores = self.getRowScores(gen, checks, None)
+            if not np.array_equal(checkScores, finalScores[checks]):
+                c = checks[np.flatnonzero(checkScores != finalScores[checks])[0]]
+                raise AssertionError(f"Creature {gen*C+c} reused the fitness {finalScores[c]} of creature {sources[c]}, but re-simulating it gives {checkScores[checks == c][0]}")
+        self.fitness_cache = {keys[c]: (finalScores[c], gen*C+c if sources[c] < 0 else sources[c]) for c in range(C)}
+        return finalScores, sources
+        
+    def getRowScores(self, gen, rows, recorder):
+        # runs the trial of just these creatures, recording into their columns of recorder
+        rowRecorder = None
+        if recorder is not None:
+            rowRecorder = TrajectoryRecorder(len(rows), self.trial_time, recorder.stride, (len(rows),)+self.creatures[gen].calmStates.shape[1:])
+        nodeCoor = self.simulatePopulation(gen, 0, self.c_count, True, self.trial_time, False, rowRecorder, rows=rows)
+        if recorder is not None:
+            recorder.frames[:,rows] = rowRecorder.frames
+        return nodeCoor[:,:,:,0].mean(axis=(1, 2))
+
+    def keepTrajectories(self, gen, recorder, currRankings, best, parents, sources):
+        # Only the creatures the UI offers to replay are kept: the best, median and worst
+        # (the previews), each species' representatives, and the first "Watch sample" batch.
+        current = self.creatures[gen]
+        keep = [currRankings[0], currRankings[self.c_count//2], currRankings[-1]]
+        keep += list(best%self.c_count) # apex and latest representatives
+        keep += list(np.flatnonzero(current.codonWithChange >= 0)) # the first creature of a new species
+        keep += list(parents[self.creatures[gen+1].codonWithChange >= 0]) # the ancestor of a new species
+        keep += range(min(8,self.c_count)) # UI.startSampleHelper shows 8 creatures at a time, starting from #0
+        for c in keep:
+            if sources[c] < 0:
+                self.trajectories.store(gen*self.c_count+c, recorder.frames[:,c])
+            elif self.trajectories.get(sources[c]) is not None: # a reused trial is the same as the one it was reused from
+                self.trajectories.store(gen*self.c_count+c, self.trajectories.get(sources[c]))
+
+    def startReplay(self, gen, c):
+        # A replay is a (nodeCoor or recorded frames, muscles, frame) tuple, advanced by stepReplay.
+        if self.trajectories is not None:
+            frames = self.trajectories.get(gen*self.c_count+c)
+            if frames is not None:
+                return frames, None, 0
+        return self.simulateImport(gen, c, c+1, True)
+
+    def stepReplay(self, replay):
+        frames, muscles, currentFrame = replay
+        if muscles is None: # just play back the recorded frames
+            return frames, None, currentFrame+1
+        return self.simulateRun(replay, 1, False)
+
+    def getReplayNodes(self, replay):
+        frames, muscles, currentFrame = replay
+        if muscles is None:
+            return self.trajectories.getNodes(frames, currentFrame)[None]
+        return frames
+        
     def getCreatureWithID(self, ID):
         return self.creatures[ID//self.c_count][ID%self.c_count]
         
-    def clone(self, parent, newID):
-        return Creature(parent.dna, newID, parent.species, self, self.ui)
+    def getParents(self, currRankings):
+        # Pairs the k-th best creature with the k-th worst. Usually the better one survives and has
+        # two children (a clone and a mutant), but the closer to the middle the pair is, the likelier
+        # the worse one wins instead, and the likelier both children are mutants.
+        # Returns which creature of this generation each child comes from, and which children mutate.
+        C = self.c_count
+        rank = np.arange(C//2)
+        winner = currRankings[rank]
+        loser = currRankings[(C-1)-rank]
+        upset = self.rng.random(C//2) < rank/C
+        winner, loser = np.where(upset, loser, winner), np.where(upset, winner, loser)
+        parents = np.zeros(C, dtype=int)
+        mutants = np.zeros(C, dtype=bool)
+        parents[winner] = parents[loser] = winner
+        # A 1st place finisher is guaranteed to make a clone, but as we get closer to the middle the odds get more likely we just get 2 mutants.
+        mutants[winner] = (self.rng.random(C//2) < rank/C*2.0)
+        mutants[loser] = True
+        return parents, mutants
+        
+    def getMutatedGenomes(self, gen, parents, mutants):
+        # The whole next generation's DNA in one go: every child starts as a copy of its parent's row,
+        # and the mutants get a small random nudge on every trait. A few of the mutants also get a big
+        # mutation in one random cell and beat, which makes them a new species.
+        # Returns the DNA, the species, and where the big mutations happened (-1 if none).
+        current = self.creatures[gen]
+        dna = current.dna[parents]
+        species = current.species[parents]
+        codonWithChange = np.full(self.c_count, -1, dtype=int)
+        mutantRows = np.flatnonzero(mutants)
+        dna[mutantRows] += self.mutation_rate*np.clip(self.rng.standard_normal((len(mutantRows),self.trait_count)),-99,99)
+        
+        bigRows = mutantRows[self.rng.random(len(mutantRows)) < self.big_mutation_rate]
+        B = len(bigRows)
+        cell_x = self.rng.integers(0, self.CW, B)
+        cell_y = self.rng.integers(0, self.CH, B)
+        cell_beat = self.rng.integers(0, self.beats_per_cycle, B)
+        big_mut_loc = (cell_x*self.CH*self.beats_per_cycle+cell_y*self.beats_per_cycle+cell_beat)*self.traits_per_box
+        # Big mutations change each trait of the cell by at least 0.5: a normal distribution with (-0.5,0.5) cut out.
+        delta = self.rng.standard_normal((B,self.traits_per_box))
+        small = np.abs(delta) < 0.5
+        while np.any(small):
+            delta[small] = self.rng.standard_normal(np.count_nonzero(small))
+            small = np.abs(delta) < 0.5
+        dna[bigRows[:,None], big_mut_loc[:,None]+np.arange(self.traits_per_box)] += delta
+        if self.traits_per_box >= 3:
+            #Cells that endure a big mutation are also required to be at least somewhat rigid, because if a cell goes from super-short to super-tall but has low rigidity the whole time, then it doesn't really matter.
+            dna[bigRows, big_mut_loc+2] = np.maximum(dna[bigRows, big_mut_loc+2], 0.5)
         
-    def mutate(self, parent, newID):
-        newDNA, newSpecies, cwc = parent.getMutatedDNA(self)
-        newCreature = Creature(newDNA, newID, newSpecies, self, self.ui)
-        if newCreature.species != parent.species:
-            self.species_info.append(SpeciesInfo(self,newCreature,parent))
-            newCreature.codonWithChange = cwc
-        return newCreature
\ No newline at end of file
+        species[bigRows] = self.species_count+np.arange(B)
+        self.species_count += B
+        codonWithChange[bigRows] = big_mut_loc
+        return dna, species, codonWithChange
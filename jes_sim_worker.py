@@ -0,0 +1,192 @@
+import threading
+import multiprocessing
+import queue
+import time
+from contextlib import nullcontext
+
+class GenerationCancelled(Exception):
+    pass
+
+class SimProgress:
+    # How far along the physics is, shared with the processes doing it (see jes_parallel.py):
+    # they count every frame they simulate, and stop a trial once it's cancelled.
+    # Each job of a run counts in its own slot of frames, so no process ever overwrites
+    # another's count. Runs are numbered, and a job left over from an older run
+    # (e.g. one that was cancelled) stops as soon as it notices it's stale.
+    def __init__(self, slots):
+        self.frames = multiprocessing.Array("q", slots, lock=False)
+        self.run = multiprocessing.Value("q", 0, lock=False)
+        self.cancelled = multiprocessing.Value("b", 0, lock=False) # 1: stop a trial, 2: stop anything (see SimWorker.stop)
+        self.stage = None # "Testing" or "Calming"
+        self.total = 0 # frames to simulate in this run, over every process
+        self.job = None # (slot, run) of the job this process is simulating
+
+    def begin(self, calmingRun, total):
+        # a new run, in the process handing out the jobs. Returns its number.
+        self.stage = "Calming" if calmingRun else "Testing"
+        self.total = total
+        self.run.value += 1
+        self.frames[:] = [0]*len(self.frames)
+        return self.run.value
+
+    def startJob(self, slot, run):
+        # in the process simulating the job
+        self.job = (slot, run)
+        self.frames[slot] = 0
+
+    def getFrames(self):
+        return sum(self.frames)
+
+    def onFrame(self, calmingRun):
+        # Called by simulateRun after every frame. Only a trial can be cancelled:
+        # by the time the children are calming, the generation has already changed the Sim.
+        slot, run = self.job
+        if run != self.run.value:
+            raise GenerationCancelled() # nobody's waiting for this job any more
+        self.frames[slot] += 1
+        if self.cancelled.value == 2 or (self.cancelled.value and not calmingRun):
+            raise GenerationCancelled()
+
+class SimWorker:
+    # Runs generations in the background, so the window keeps responding (and the history
+    # can be browsed) while ALAP is on. A thread does each generation's bookkeeping, holding
+    # sim.lock while it changes the Sim, and the physics itself runs in another process
+    # (sim.pool), since a thread doing it would be fighting the UI for Python's GIL.
+    # The UI thread holds sim.lock for each frame it draws (see jes.py), so it never sees
+    # a half-finished generation. Finished generation numbers go into a queue, and the UI
+    # thread shows them (graphs, slider, mosaic) when it gets to them (see Sim.checkALAP).
+    def __init__(self, sim):
+        self.sim = sim
+        self.progress = SimProgress(max(sim.workers,1)) # a slot for every job of a run
+        if sim.pool is not None: # the pool needs to know about self.progress
+            sim.pool.close()
+            sim.pool = None
+        self.finished = queue.Queue()
+        self.requested = 0 # generations still to run (-1: keep going until paused)
+        self.error = None
+        self.busy = False
+        self.stopping = False
+        self.wantsLock = False # the UI thread steps aside while this is set, so it can't starve the worker
+        self.wake = threading.Condition()
+        self.thread = threading.Thread(target=self.loop, name="jes-sim-worker", daemon=True)
+        self.thread.start()
+
+    def start(self, count=-1):
+        # runs count more generations, or keeps going until pause() if count is -1
+        with self.wake:
+            self.requested = count
+            self.progress.cancelled.value = 0
+            self.wake.notify()
+
+    def pause(self):
+        # stops once the current generation is done
+        with self.wake:
+            self.requested = 0
+
+    def cancel(self):
+        # Stops as soon as possible. A generation still being tested is dropped (nothing has
+        # changed yet, and it's redone next time), but one that's already calming its
+        # children has to finish first.
+        with self.wake:
+            self.requested = 0
+            self.progress.cancelled.value = 1
+
+    def loop(self):
+        sim = self.sim
+        while True:
+            with self.wake:
+                while self.requested == 0 and not self.stopping:
+                    self.wake.wait()
+                if self.stopping:
+                    return
+                if self.requested > 0:
+                    self.requested -= 1
+                self.busy = True
+            profiler = sim.profiler # the UI can turn profiling on mid-generation
+            try:
+                with self.getLock():
+                    if profiler is not None:
+                        profiler.startGeneration(len(sim.creatures)-1)
+                    gen = sim.runGeneration()
+                    if profiler is not None:
+                        profiler.endGeneration(False) # logged once the UI thread has drawn it (see Sim.checkALAP)
+                    self.finished.put(gen) # before letting go of the lock, so the UI's next frame shows it first
+            except GenerationCancelled:
+                if profiler is not None:
+                    profiler.current = None
+            except Exception as e: # handed to the UI thread, which raises it (see getFinished)
+                self.error = e
+                self.requested = 0
+            self.progress.stage = None
+            self.busy = False
+
+    def stop(self):
+        # For good, e.g. when the window closes: whatever generation is running gets dropped,
+        # even mid-calming (the checkpoint, if any, still has the last finished one),
+        # the thread ends, and the physics processes are killed.
+        with self.wake:
+            self.requested = 0
+            self.stopping = True
+            self.progress.cancelled.value = 2
+            self.wake.notify()
+        self.thread.join(10)
+        if self.sim.pool is not None:
+            self.sim.pool.terminate()
+            self.sim.pool = None
+
+    def getFinished(self):
+        # the generations finished since the last call, oldest first
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+        gens = []
+        while not self.finished.empty():
+            gens.append(self.finished.get())
+        return gens
+
+    def getProgress(self):
+        # (stage, frames simulated so far, frames in this run), or None when idle
+        if not self.busy or self.progress.stage is None:
+            return None
+        return self.progress.stage, self.progress.getFrames(), self.progress.total
+
+    def getLock(self):
+        self.wantsLock = True
+        self.sim.lock.acquire()
+        self.wantsLock = False
+        return _Locked(self.sim.lock)
+
+    def uiLock(self):
+        # sim.lock for the UI thread, once the worker has had its turn
+        while self.wantsLock:
+            time.sleep(0.001)
+        return self.sim.lock
+
+    def isWorkerThread(self):
+        return threading.current_thread() is self.thread
+
+    def unlocked(self):
+        # sim.lock is let go of while the physics runs, so the UI thread can draw meanwhile
+        return _Unlocked(self) if self.isWorkerThread() else nullcontext()
+
+class _Locked:
+    # releases a lock that's already held
+    def __init__(self, lock):
+        self.lock = lock
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        self.lock.release()
+
+class _Unlocked:
+    def __init__(self, worker):
+        self.worker = worker
+
+    def __enter__(self):
+        self.worker.sim.lock.release()
+
+    def __exit__(self, *args):
+        self.worker.getLock()
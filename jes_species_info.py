@@ -54,7 +54,6 @@ class SpeciesInfo:
     def getPerformance(self, sim, index):
         gen = math.floor(self.reps[index]//self.sim.c_count)
         c = self.reps[index]%self.sim.c_count
-        creature = sim.creatures[gen][c]
-        return creature.fitness
+        return sim.creatures[gen].fitness[c]
         
         
\ No newline at end of file
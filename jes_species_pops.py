@@ -0,0 +1,57 @@
+import numpy as np
+import bisect
+
+class SpeciesPops:
+    # One generation's species populations (an entry of sim.species_pops). Species are kept
+    # sorted by ID, and the creatures of the generation are laid out species by species,
+    # so species[i] covers creatures starts[i]..ends[i]-1 of the SAC's vertical axis.
+    # pops[sp] still gives [population, start, end] like the old dict did.
+    def __init__(self, species, pops):
+        order = np.argsort(species)
+        self.species = [int(sp) for sp in np.asarray(species)[order]]
+        self.pops = [int(pop) for pop in np.asarray(pops)[order]]
+        self.ends = list(np.cumsum(self.pops, dtype=int).tolist())
+        self.starts = [end-pop for end, pop in zip(self.ends, self.pops)]
+        most = max(self.pops)
+        # the most populous species. Ties go to the later one, as max() over the old [pop, start, end] lists did
+        self.top = self.species[len(self.pops)-1-self.pops[::-1].index(most)]
+
+    def __len__(self):
+        return len(self.species)
+
+    def getIndex(self, sp):
+        # index of sp in self.species, or None if it isn't alive in this generation
+        i = bisect.bisect_left(self.species, sp)
+        if i < len(self.species) and self.species[i] == sp:
+            return i
+        return None
+
+    def __contains__(self, sp):
+        return self.getIndex(sp) is not None
+
+    def __getitem__(self, sp):
+        i = self.getIndex(sp)
+        if i is None:
+            raise KeyError(sp)
+        return [self.pops[i], self.starts[i], self.ends[i]]
+
+    def keys(self):
+        return self.species
+
+    def __iter__(self):
+        return iter(self.species)
+
+    def items(self):
+        # (species, [population, start, end]) in order of species ID
+        return [(self.species[i], [self.pops[i], self.starts[i], self.ends[i]]) for i in range(len(self.species))]
+
+    def getRangeEvenIfNone(self, sp):
+        # sp's [population, start, end], or if it's not alive, an empty range where it would be
+        i = bisect.bisect_left(self.species, sp)
+        if i < len(self.species) and self.species[i] == sp:
+            return [self.pops[i], self.starts[i], self.ends[i]]
+        val = self.ends[-1] if i >= len(self.species) else self.starts[i]
+        return [0,val,val]
+
+    def getTotal(self):
+        return self.ends[-1]
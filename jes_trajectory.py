@@ -0,0 +1,47 @@
+import numpy as np
+from collections import OrderedDict
+from utils import arrayLerp
+
+class TrajectoryRecorder:
+    # Keeps the node positions of every creature in a trial, every `stride` frames,
+    # so the creatures worth replaying can be kept afterwards (see TrajectoryStore).
+    def __init__(self, count, frameCount, stride, nodeShape):
+        COUNT, W, H, _ = nodeShape
+        self.stride = stride
+        self.frames = np.zeros((frameCount//stride+1,count,W,H,2), dtype=np.float32) # float32 is plenty for drawing
+
+    def record(self, f, nodeCoor):
+        # f is how many frames have been simulated so far
+        if f%self.stride == 0:
+            self.frames[f//self.stride] = nodeCoor[:,:,:,0:2]
+
+class TrajectoryStore:
+    # The recorded trials of the creatures the UI can replay, keyed by creature ID.
+    # It's bounded by maxBytes: the least recently used trajectories are dropped first,
+    # and a creature without a trajectory is simply re-simulated when it's replayed.
+    def __init__(self, stride, maxBytes):
+        self.stride = stride
+        self.maxBytes = maxBytes
+        self.trajectories = OrderedDict()
+        self.bytes = 0
+
+    def store(self, ID, frames):
+        if ID in self.trajectories:
+            return
+        self.trajectories[ID] = frames.copy()
+        self.bytes += frames.nbytes
+        while self.bytes > self.maxBytes and len(self.trajectories) > 0:
+            _, old = self.trajectories.popitem(last=False)
+            self.bytes -= old.nbytes
+
+    def get(self, ID):
+        if ID not in self.trajectories:
+            return None
+        self.trajectories.move_to_end(ID)
+        return self.trajectories[ID]
+
+    def getNodes(self, frames, f):
+        # node positions after f frames, interpolated between the recorded ones
+        i = min(f//self.stride, len(frames)-1)
+        j = min(i+1, len(frames)-1)
+        return arrayLerp(frames[i], frames[j], (f%self.stride)/self.stride)
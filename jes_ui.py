@@ -4,6 +4,8 @@ from jes_dataviz import displayAllGraphs, drawAllGraphs
 from jes_shapes import drawRect, drawRingLight, drawX, centerText, alignText, rightText, drawClock, drawSpeciesCircle
 from jes_slider import Slider
 from jes_button import Button
+from jes_icon_cache import IconCache
+from jes_profiler import Profiler
 import time
 import numpy as np
 import math
@@ -11,7 +13,7 @@ import random
 
 class UI:
     def __init__(self, _W_W, _W_H, _MOVIE_SINGLE_DIM, _GRAPH_COOR, _SAC_COOR, _GENEALOGY_COOR,
-    _COLUMN_MARGIN, _MOSAIC_DIM, _MENU_TEXT_UP, _CM_MARGIN1, _CM_MARGIN2):
+    _COLUMN_MARGIN, _MOSAIC_DIM, _MENU_TEXT_UP, _CM_MARGIN1, _CM_MARGIN2, _ICON_CACHE_MB=128):
         self.sliderList = []
         self.buttonList = []
         pygame.font.init()
@@ -26,8 +28,12 @@ class UI:
         
         self.GRAPH_COOR = _GRAPH_COOR
         self.graph = pygame.Surface(self.GRAPH_COOR[2:4], pygame.SRCALPHA, 32)
+        self.graphEnvelope = None # the percentiles, summarized per pixel column (see drawLineGraph)
         self.SAC_COOR = _SAC_COOR
         self.sac = pygame.Surface(self.SAC_COOR[2:4], pygame.SRCALPHA, 32)
+        self.sacStrip = None # every generation's SAC slice, drawn once (see drawSAC)
+        self.sacDrawn = 0
+        self.sacGenW = 0
         self.GENEALOGY_COOR = _GENEALOGY_COOR
         self.gene_graph = pygame.Surface(self.GENEALOGY_COOR[2:4], pygame.SRCALPHA, 32)
         
@@ -44,6 +50,7 @@ class UI:
         s1 = int((self.MS_WC)/self.MOSAIC_DIM[0]-self.CM_MARGIN2*2)
         s2 = int((self.MS_WC)/self.MOSAIC_DIM[1]-self.CM_MARGIN2*2)
         self.ICON_DIM = ((s1,s1),(s2,s2),(s2,s2))
+        self.iconCache = IconCache(self, _ICON_CACHE_MB*1024*1024)
         
         self.mosaicVisible = False
         self.CLH = [None,None,None]  # Creature Location Highlight. First: is it in the mosaic (0), or top-3? (1). Second: Index of highlighted creature? Third: rank of creature?
@@ -77,6 +84,7 @@ class UI:
         self.SAMPLE_FREEZE_TIME = 90
         self.showXs = True
         self.species_storage = None
+        self.showProfile = False
         self.storage_coor = (660,52)
         self.running = True
         
@@ -90,7 +98,7 @@ class UI:
         self.sortButton = Button(self,buttonCoor[1],["Sort by ID","Sort by fitness","Sort by weakness"],self.toggleSort)
         self.styleButton = Button(self,buttonCoor[2],["Big Icons","Small Icons", "Species Tiles"],self.toggleStyle)
         self.sampleButton = Button(self,buttonCoor[3],["Watch sample","Stop sample"],self.startSample)
-        self.doGenButton = Button(self,buttonCoor[4],["Do a generation"],self.sim.doGeneration)
+        self.doGenButton = Button(self,buttonCoor[4],["Do a generation"],self.doGeneration)
         self.ALAPButton = Button(self,buttonCoor[5],["Turn on ALAP","Turn off ALAP"],self.doNothing)
         
         
@@ -156,12 +164,12 @@ class UI:
                     gen = ID//self.sim.c_count
                     c = ID%self.sim.c_count
                     self.creatureHighlight.append(self.sim.creatures[gen][c])
-                    self.visualSimMemory.append(self.sim.simulateImport(gen,c,c+1,True))
+                    self.visualSimMemory.append(self.sim.startReplay(gen,c))
                     self.movieScreens.append(None)
                 self.drawInfoBarSpecies(self.CLH[1])
             else: # a creature was highlighted!
                 self.creatureHighlight = [self.sim.creatures[gen][self.CLH[1]]]
-                self.visualSimMemory = [self.sim.simulateImport(gen, self.CLH[1], self.CLH[1]+1,True)]
+                self.visualSimMemory = [self.sim.startReplay(gen, self.CLH[1])]
                 self.movieScreens = [None]*1
                 self.drawInfoBarCreature(self.sim.creatures[gen][self.CLH[1]])
         
@@ -182,31 +190,45 @@ class UI:
                     answer = s
         return answer
         
+    def getMosaicSlots(self, gen):
+        # Where in the mosaic each creature of this generation goes, depending on the sort setting.
+        generation = self.sim.creatures[gen]
+        slots = np.arange(self.sim.c_count)
+        tested = (generation.rank >= 0)
+        if self.sortButton.setting == 1:
+            slots = np.where(tested, generation.rank, slots)
+        elif self.sortButton.setting == 2:
+            slots = np.where(tested, self.sim.c_count-1-generation.rank, slots)
+        return slots
+        
+    def getIconCoor(self, gen, c):
+        DIM = self.MOSAIC_DIM[self.styleButton.setting]
+        SPACING = self.MS_WC/DIM
+        i = self.getMosaicSlots(gen)[c]
+        return ((i%DIM)*SPACING+self.CM_MARGIN2, (i//DIM)*SPACING+self.CM_MARGIN2, SPACING, SPACING)
+        
     def drawCreatureMosaic(self, gen):
         self.mosaicScreen.fill(self.MOSAIC_COLOR)
-        for c in range(self.sim.c_count):
-            i = c
-            if self.sim.creatures[gen][c].rank is not None:
-                if self.sortButton.setting == 1:
-                    i = self.sim.creatures[gen][c].rank
-                elif self.sortButton.setting == 2:
-                    i = self.reverse(self.sim.creatures[gen][c].rank)
-            DIM = self.MOSAIC_DIM[self.styleButton.setting]
-            x = i%DIM
-            y = i//DIM
-            creature = self.sim.creatures[gen][c]
-            SPACING = self.MS_WC/DIM
-            creature.iconCoor = (x*SPACING+self.CM_MARGIN2, y*SPACING+self.CM_MARGIN2, SPACING, SPACING)
-            if creature.iconCoor[1] < self.mosaicScreen.get_height():
-                s = self.styleButton.setting
-                if s <= 1:
-                    self.mosaicScreen.blit(creature.icons[s], creature.iconCoor)
-                elif s == 2:
-                    EXTRA = 1
-                    pygame.draw.rect(self.mosaicScreen,speciesToColor(creature.species, self),(creature.iconCoor[0],creature.iconCoor[1],SPACING+EXTRA,SPACING+EXTRA))
-                if not creature.living and self.showXs:
-                    color = (255,0,0) if s <= 1 else (0,0,0)
-                    drawX(creature.iconCoor, self.ICON_DIM[s][0], color, self.mosaicScreen)
+        generation = self.sim.creatures[gen]
+        slots = self.getMosaicSlots(gen)
+        DIM = self.MOSAIC_DIM[self.styleButton.setting]
+        SPACING = self.MS_WC/DIM
+        s = self.styleButton.setting
+        visible = np.flatnonzero((slots//DIM)*SPACING+self.CM_MARGIN2 < self.mosaicScreen.get_height())
+        if s <= 1:
+            icons = self.iconCache.getIcons(generation, visible, s) # all drawn in one batch
+        for j in range(len(visible)):
+            c = visible[j]
+            i = slots[c]
+            iconCoor = ((i%DIM)*SPACING+self.CM_MARGIN2, (i//DIM)*SPACING+self.CM_MARGIN2, SPACING, SPACING)
+            if s <= 1:
+                self.mosaicScreen.blit(icons[j], iconCoor)
+            elif s == 2:
+                EXTRA = 1
+                pygame.draw.rect(self.mosaicScreen,speciesToColor(int(generation.species[c]), self),(iconCoor[0],iconCoor[1],SPACING+EXTRA,SPACING+EXTRA))
+            if not generation.living[c] and self.showXs:
+                color = (255,0,0) if s <= 1 else (0,0,0)
+                drawX(iconCoor, self.ICON_DIM[s][0], color, self.mosaicScreen)
 
     def drawInfoBarCreature(self, creature):
         X_center = int(self.INFO_W*0.5)
@@ -282,13 +304,12 @@ class UI:
     def drawLightboard(self, screen, species, gen, coor):
         DIM = self.MOSAIC_DIM[-1]
         R = coor[2]/DIM
+        inSpecies = (self.sim.creatures[gen].species[self.sim.rankings[gen]] == species) # in order of rank
+        color = speciesToColor(species, self)
         for c in range(self.sim.c_count):
             x = coor[0]+R*(c%DIM)
             y = coor[1]+R*(c//DIM)
-            col = (0,0,0)
-            creature = self.sim.creatures[gen][self.sim.rankings[gen][c]]
-            if creature.species == species:
-                col = speciesToColor(species, self)
+            col = color if inSpecies[c] else (0,0,0)
             pygame.draw.rect(screen,col,(x,y,R,R))
         
     def drawMenuText(self):
@@ -331,15 +352,16 @@ class UI:
             if self.sample_frames >= self.sim.trial_time+self.SAMPLE_FREEZE_TIME:
                 self.startSampleHelper()
         for i in range(L):
-            if self.visualSimMemory[i][2] < self.sim.trial_time:
-                self.visualSimMemory[i] = self.sim.simulateRun(self.visualSimMemory[i], 1, False)
+            if self.visualSimMemory[i][2] < self.sim.trial_time:
+                self.visualSimMemory[i] = self.sim.stepReplay(self.visualSimMemory[i])
             DIM = arrayIntMultiply(self.MOVIE_SINGLE_DIM, MSCALE[self.CLH[0]])
             self.movieScreens[i] = pygame.Surface(DIM, pygame.SRCALPHA, 32)
         
-            nodeArr, _, currentFrame = self.visualSimMemory[i]
-            s = DIM[0]/(self.sim.CW+2)*0.5 # visual transform scale
+            nodeArr = self.sim.getReplayNodes(self.visualSimMemory[i])
+            currentFrame = self.visualSimMemory[i][2]
+            s = DIM[0]/(max(self.sim.CW,self.sim.CH)+2)*0.5 # visual transform scale, so the longer side fits
         
-            averageX = np.mean(nodeArr[:,:,:,0])
+            averageX = float(np.mean(nodeArr[:,:,:,0]))
             transform = [DIM[0]/2-averageX*s,DIM[1]*0.8,s]
             self.creatureHighlight[i].drawCreature(self.movieScreens[i],nodeArr[0],currentFrame,transform,True,(i == 0))
                 
@@ -353,7 +375,9 @@ class UI:
 
     def detectEvents(self):
         for event in pygame.event.get():
-            if event.type == pygame.KEYDOWN:
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                self.running = False # jes.py stops the background worker on its way out
+            elif event.type == pygame.KEYDOWN:
                 new_gen = None
                 if event.key == pygame.K_LEFT:
                     new_gen = max(0,self.genSlider.val-1)
@@ -372,11 +396,21 @@ class UI:
                     c = self.getHighlightedSpecies()
                     if c is not None:
                         self.sc_colors[c] = str(random.uniform(0,1))
+                        self.iconCache.clear()
+                        self.sacStrip = None # the SAC shows species colors too, so it gets redrawn from scratch
+                        self.drawCreatureMosaic(self.genSlider.val)
                         drawAllGraphs(self.sim, self)
                         self.clearMovies()
                         self.detectMouseMotion()
                 elif event.key == 13: # pressing Enter
-                    self.sim.doGeneration(None)
+                    self.doGeneration(None)
+                elif event.key == 8 and self.sim.worker is not None: # pressing Backspace stops the generation running in the background
+                    self.ALAPButton.setting = 0
+                    self.sim.worker.cancel()
+                elif event.key == 112: # pressing 'P' toggles how long each part of the last generation took
+                    self.showProfile = (not self.showProfile)
+                    if self.showProfile and self.sim.profiler is None:
+                        self.sim.profiler = Profiler()
                 elif event.key == 113: # pressing 'Q'
                     self.showCreaturesButton.timeOfLastClick = time.time()
                     self.showCreaturesButton.setting = 1-self.showCreaturesButton.setting
@@ -405,8 +439,28 @@ class UI:
         self.drawPreviews()
         displayAllGraphs(self.screen, self.sim, self)
         self.drawSlidersAndButtons()
+        self.drawSimProgress()
         self.displayCreatureMosaic(self.screen)
         self.displayMovies(self.screen)
+        if self.showProfile:
+            self.displayProfile(self.screen)
+            
+    def displayProfile(self, screen):
+        record = None if self.sim.profiler is None else self.sim.profiler.getLast()
+        lines = ["Profiling... press Enter to run a generation"]
+        if record is not None:
+            lines = [f"Generation {record['gen']}: {record['total_s']*1000:.0f} ms"]
+            for name, t in record["time_s"].items():
+                if t > 0:
+                    lines.append(f"{name}: {t*1000:.1f} ms ({t/record['total_s']*100:.0f}%)")
+            lines.append(f"{record['creature_frames_per_s']:,.0f} creature-frames/s")
+            lines.append(f"{record['creatures_per_s']:,.1f} creatures/s")
+        LINE_H = 24
+        x = self.W_W-420
+        y = 20
+        pygame.draw.rect(screen, self.BLACK, (x, y, 400, LINE_H*len(lines)+10))
+        for i, line in enumerate(lines):
+            alignText(screen, line, x+10, y+5+LINE_H*i+LINE_H/2, self.WHITE, self.tinyFont, 0.0, None)
 
     def displayCreatureMosaic(self, screen):
         timeSinceLastPress = time.time()-self.showCreaturesButton.timeOfLastClick
@@ -443,7 +497,7 @@ class UI:
             DIM = self.previewLocations[self.CLH[2]]
             self.screen.blit(drawRingLight(DIM[2],DIM[3],6),(DIM[0],DIM[1]))
         else:
-            coor = self.sim.creatures[gen][self.CLH[1]].iconCoor
+            coor = self.getIconCoor(gen, self.CLH[1])
             x = coor[0]+self.CM_MARGIN1
             y = coor[1]+self.CM_MARGIN1
             self.screen.blit(drawRingLight(coor[2],coor[3],6),(x,y))
@@ -483,6 +537,25 @@ class UI:
     def toggleStyle(self, button):
         self.drawCreatureMosaic(self.genSlider.val)
     
+    def doGeneration(self, button):
+        worker = self.sim.worker
+        if worker is None:
+            self.sim.doGeneration(button)
+        elif worker.requested >= 0: # with ALAP on, it's running generations anyway
+            worker.start(worker.requested+1)
+            
+    def drawSimProgress(self):
+        # how far along the generation running in the background is, above the ALAP button
+        progress = None if self.sim.worker is None else self.sim.worker.getProgress()
+        if progress is None:
+            return
+        stage, done, total = progress
+        x, y, w, h = self.ALAPButton.dim
+        gen = len(self.sim.creatures)-1
+        centerText(self.screen, f"Gen {gen}: {stage} {done}/{total}", x+w/2, y-30, self.WHITE, self.tinyFont)
+        pygame.draw.rect(self.screen, self.GRAYISH, (x, y-12, w, 8))
+        pygame.draw.rect(self.screen, self.WHITE, (x, y-12, w*done/max(total,1), 8))
+        
     def doNothing(self, button):
         a = 5
         
@@ -502,7 +575,7 @@ class UI:
             gen = self.genSlider.val
             c = (self.sample_i+i)%self.sim.c_count
             self.creatureHighlight.append(self.sim.creatures[gen][c])
-            self.visualSimMemory.append(self.sim.simulateImport(gen,c,c+1,True))
+            self.visualSimMemory.append(self.sim.startReplay(gen,c))
             self.movieScreens.append(None)
         self.sample_i += L
         
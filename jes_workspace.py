@@ -0,0 +1,41 @@
+import numpy as np
+from utils import getEdgeNodes, getEdgeRestLengths, getEdgeCounts, applyEdgeForces
+
+class Workspace:
+    # Every scratch buffer simulateRun needs, allocated once per population size,
+    # so the frame loop itself can run entirely with in-place (out=) operations.
+    def __init__(self, nodeShape, beats_per_cycle, dtype=np.float64):
+        COUNT, W, H, _ = nodeShape  # W and H are node counts, one more than the cell counts
+        self.nodeShape = nodeShape
+        CW = W-1
+        CH = H-1
+        edgeShapes = [(COUNT,CW,H),(COUNT,W,CH),(COUNT,CW,CH),(COUNT,CW,CH)]
+        self.scratch = [[np.empty(shape, dtype=dtype) for i in range(4)] for shape in edgeShapes]
+        self.counts = getEdgeCounts(CW,CH,dtype)
+        self.rest_buffers = [(np.zeros(edgeShapes[0], dtype=dtype), np.zeros(edgeShapes[1], dtype=dtype)) for beat in range(beats_per_cycle)]
+        self.rests = [None]*beats_per_cycle  # filled in by loadMuscles
+
+        self.touchingGround = np.empty((COUNT,W,H), dtype=bool)
+        self.groundFriction = np.empty((COUNT,W,H), dtype=dtype)
+
+    def loadMuscles(self, muscles):
+        # Desired edge lengths only depend on the muscles, so they're computed once per run, not once per frame.
+        for beat in range(len(self.rests)):
+            self.rests[beat] = getEdgeRestLengths(muscles[:,:,:,beat,:], self.rest_buffers[beat])
+
+    def applyMuscles(self, n, beat, muscle_coef):
+        nodes = getEdgeNodes(n)
+        rests = self.rests[beat]
+        for e in range(4):
+            applyEdgeForces(nodes[e][0],nodes[e][1],rests[e],self.counts[e],muscle_coef,self.scratch[e])
+
+    def applyGround(self, n, floor_y, ceiling_y, ground_friction_coef):
+        y = n[:,:,:,1]
+        np.greater_equal(y, floor_y, out=self.touchingGround)  # only True where nodes touch the floor
+        np.subtract(y, floor_y, out=self.groundFriction)  # pressure
+        self.groundFriction *= ground_friction_coef
+        self.groundFriction *= self.touchingGround
+        np.power(0.5, self.groundFriction, out=self.groundFriction)
+
+        np.clip(y, ceiling_y, floor_y, out=y) # clip nodes below the ground back to ground level
+        n[:,:,:,2] *= self.groundFriction # any nodes touching the ground must be slowed down by ground friction.
@@ -1,4 +1,5 @@
 from hashlib import sha256
+from functools import lru_cache
 import numpy as np
 import math
 
@@ -36,7 +37,11 @@ def hue_to_rgb(hue):
     return (255*r[0], 200*r[1],255*r[2])
     
 def species_to_name(s, ui):
-    salted = str(s)+ui.salt
+    return getSpeciesName(None if s is None else int(s), ui.salt) # None is the ancestor of the first species
+    
+@lru_cache(maxsize=65536) # names get looked up every frame, and hashing them each time adds up
+def getSpeciesName(s, salt):
+    salted = str(s)+salt
     _hex = sha256(salted.encode('utf-8')).hexdigest()
     result = int(_hex, 16)
     length_choices = [5,5,6,6,7]
@@ -67,9 +72,16 @@ def brighten(color, b):
         return (color[0]*b, color[1]*b, color[2]*b)
     
 def speciesToColor(s, ui):
-    salted = str(s)+ui.salt
-    if s in ui.sc_colors:
-        salted = ui.sc_colors[s]+ui.salt
+    s = int(s)
+    return getSpeciesColor(s, ui.salt, ui.sc_colors.get(s))
+    
+@lru_cache(maxsize=65536)
+def getSpeciesColor(s, salt, override):
+    # override is the user's recoloring of this species (the C key). It's part of the cache key,
+    # so a recolored species simply misses the cache instead of needing it cleared.
+    salted = str(s)+salt
+    if override is not None:
+        salted = override+salt
     _hex = sha256(salted.encode('utf-8')).hexdigest()
     hue = (int(_hex, 16)%10000)/10000
     brightness = (math.floor(int(_hex, 16)//10000)%100)/100
@@ -94,57 +106,86 @@ def getDistanceArray(a,b):
     y_dist = a[:,:,:,1]-b[:,:,:,1]
     return np.sqrt(np.square(x_dist)+np.square(y_dist))
     
-def applyMuscles(n,m,muscle_coef):
-    xNeighborDists = getDistanceArray(n[:,:-1,:],n[:,1:,:])
-    yNeighborDists = getDistanceArray(n[:,:,:-1],n[:,:,1:])
-    posDiagNeighborDists = getDistanceArray(n[:,:-1,:-1],n[:,1:,1:])
-    negDiagNeighborDists = getDistanceArray(n[:,:-1,1:],n[:,1:,:-1])
-    
-    MAs = [None]*6
-    segments = [[0,0,1,0],[0,1,1,1],
-    [0,0,0,1],[1,0,1,1],[0,0,1,1],[0,1,1,0]]
-    segments2 = [[0,0,1,0],[0,1,1,1],
-    [0,0,0,1],[1,0,1,1],[0,0,1,1],[0,1,1,0]]
-    
-    
-    MAs[0] = getMuscleAttraction(xNeighborDists[:,:,:-1],m[:,:,:,0],muscle_coef)
-    MAs[1] = getMuscleAttraction(xNeighborDists[:,:,1:],m[:,:,:,0],muscle_coef)
-    MAs[2] = getMuscleAttraction(yNeighborDists[:,:-1,:],m[:,:,:,1],muscle_coef)
-    MAs[3] = getMuscleAttraction(yNeighborDists[:,1:,:],m[:,:,:,1],muscle_coef)
-    MAs[4] = getMuscleAttraction(posDiagNeighborDists,m[:,:,:,3],muscle_coef)
-    MAs[5] = getMuscleAttraction(negDiagNeighborDists,m[:,:,:,3],muscle_coef)
+def getIconTransform(S, CW, CH):
+    # [x offset, y offset, scale] that fits a calm creature of CW x CH cells into an S x S icon.
+    # The longer side sets the scale, and the shorter one is centered.
+    D = max(CW,CH)
+    s = S/(D+2.85)
+    return [S/2,S/(D+2)+(D-CH)/2*s,s]
     
+def applyMuscles(n,m,muscle_coef):
     # The array n is a 100 x 5 x 5 x 4 dimensional array,
     # and it encodes the position and velocity data for all 100 creatures on a frame.
     
     # Dimension 1: 100 creatures (creature ID)
-    # Dimension 2: 5 nodes across the x-dimensional
-    # Dimension 3: 5 nodes across the y-dimensional
+    # Dimension 2: CW+1 (here 5) nodes across the x-dimension
+    # Dimension 3: CH+1 (here 5) nodes across the y-dimension
     # Dimension 4: Which coordinate to do you want (x, y, vx, vy)
+    # m is the matching (creatures, CW, CH, traits) array of one beat's muscles.
+    
+    # Every edge of the node lattice is visited exactly once: its delta, length and
+    # spring force are computed a single time, and the force is added straight into
+    # the velocity slots of n. Interior edges are shared by two cells, so their
+    # spring pulls towards the sum of both cells' desired lengths.
     _, CW, CH, __ = n.shape
     CW -= 1
     CH -= 1
-    
-    for dire in range(6):
-        s = segments[dire]
-        sli1 = n[:,s[0]:s[0]+CW,s[1]:s[1]+CW]
-        sli2 = n[:,s[2]:s[2]+CH,s[3]:s[3]+CH]
-        
-        delta_x = sli1[:,:,:,0]-sli2[:,:,:,0]
-        delta_y = sli1[:,:,:,1]-sli2[:,:,:,1]
+    rests = getEdgeRestLengths(m)
+    counts = getEdgeCounts(CW,CH,n.dtype)
+    nodes = getEdgeNodes(n)
+    for e in range(4):
+        applyEdgeForces(nodes[e][0],nodes[e][1],rests[e],counts[e],muscle_coef)
         
-        delta_magnitude = np.sqrt(np.square(delta_x)+np.square(delta_y))
-        delta_nx = delta_x/delta_magnitude
-        delta_ny = delta_y/delta_magnitude
-        
-        n[:,s[0]:s[0]+CW,s[1]:s[1]+CW,2] += delta_nx*MAs[dire]
-        n[:,s[0]:s[0]+CW,s[1]:s[1]+CW,3] += delta_ny*MAs[dire]
-        n[:,s[2]:s[2]+CH,s[3]:s[3]+CH,2] -= delta_nx*MAs[dire]
-        n[:,s[2]:s[2]+CH,s[3]:s[3]+CH,3] -= delta_ny*MAs[dire]
+def getEdgeNodes(n):
+    # The two end nodes of every edge, for the 4 edge families:
+    # edges along dimension 2 (cell widths), along dimension 3 (cell heights), and both diagonals of each cell
+    return [(n[:,:-1,:],n[:,1:,:]), (n[:,:,:-1],n[:,:,1:]),
+    (n[:,:-1,:-1],n[:,1:,1:]), (n[:,:-1,1:],n[:,1:,:-1])]
+
+def getEdgeRestLengths(m, out=None):
+    COUNT, CW, CH, _ = m.shape
+    if out is None:
+        out = (np.zeros((COUNT,CW,CH+1), dtype=m.dtype), np.zeros((COUNT,CW+1,CH), dtype=m.dtype))
+    widths, heights = out
+    widths.fill(0)
+    widths[:,:,:-1] += m[:,:,:,0]
+    widths[:,:,1:] += m[:,:,:,0]
+    heights.fill(0)
+    heights[:,:-1,:] += m[:,:,:,1]
+    heights[:,1:,:] += m[:,:,:,1]
+    return widths, heights, m[:,:,:,3], m[:,:,:,3]
+
+def getEdgeCounts(CW,CH,dtype=np.float64):
+    # how many cells share each edge: 1 on the border, 2 inside
+    return [getSharedEdgeCount(CH,dtype), getSharedEdgeCount(CW,dtype)[:,None], 1, 1]
+    
+def getSharedEdgeCount(cells,dtype):
+    count = np.full(cells+1,2.0,dtype=dtype)
+    count[0] = count[-1] = 1.0
+    return count
+
+def applyEdgeForces(a,b,rest,count,muscle_coef,scratch=None):
+    # scratch: optional preallocated (delta_x, delta_y, dist, force) buffers, shaped like rest (see jes_workspace.py)
+    if scratch is None:
+        scratch = [np.empty(a.shape[:-1], dtype=a.dtype) for i in range(4)]
+    delta_x, delta_y, dist, force = scratch
+    np.subtract(a[...,0],b[...,0],out=delta_x)
+    np.subtract(a[...,1],b[...,1],out=delta_y)
+    np.multiply(delta_x,delta_x,out=dist)
+    np.multiply(delta_y,delta_y,out=force)
+    dist += force
+    np.sqrt(dist,out=dist)
+    np.multiply(count,dist,out=force)
+    np.subtract(rest,force,out=force)
+    force *= muscle_coef
+    force /= dist  # spring force, divided by length so that delta becomes the unit vector
+    delta_x *= force
+    delta_y *= force
+    a[...,2] += delta_x
+    a[...,3] += delta_y
+    b[...,2] -= delta_x
+    b[...,3] -= delta_y
         
-def getMuscleAttraction(dists,m,muscle_coef):
-    return (m-dists)*muscle_coef
-    
 def getDist(x1, y1, x2, y2):
     return np.linalg.norm(np.array([x2-x1,y2-y1]))
     